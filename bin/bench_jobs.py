@@ -0,0 +1,38 @@
+#! /usr/bin/env python
+"""Measure the throughput of the parallel record stream processing per number of jobs on the test fixtures."""
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import time
+
+import tallipoika.cli as cli
+
+ENCODING = 'utf-8'
+FIXTURES = pathlib.Path('test', 'fixtures', 'reference_upstream_input')
+REPETITIONS = int(os.getenv('BENCH_REPETITIONS', '20000'))
+BATCH_SIZE = os.getenv('BENCH_BATCH_SIZE', str(cli.BATCH_SIZE))
+JOBS = tuple(int(n) for n in os.getenv('BENCH_JOBS', '1,2,4,8').split(','))
+
+records = [json.dumps(json.loads(path.read_text(encoding=ENCODING))) for path in sorted(FIXTURES.glob('*.json'))]
+
+with tempfile.TemporaryDirectory() as folder:
+    in_path = pathlib.Path(folder, 'fixtures.jsonl')
+    with open(in_path, 'wt', encoding=ENCODING) as handle:
+        for _ in range(REPETITIONS):
+            handle.write('\n'.join(records) + '\n')
+    count = REPETITIONS * len(records)
+    size = in_path.stat().st_size
+    print(f'corpus: {count} records from {FIXTURES} with {size} bytes', file=sys.stderr)
+
+    baseline = None
+    for jobs in JOBS:
+        start = time.perf_counter()
+        cli.app(['-s', '--lines', '--jobs', str(jobs), '--batch-size', BATCH_SIZE, '-o', os.devnull, str(in_path)])
+        seconds = time.perf_counter() - start
+        baseline = baseline or seconds
+        print(
+            f'jobs={jobs:>3} seconds={seconds:8.3f} records/s={count / seconds:12.0f}'
+            f' MB/s={size / seconds / 1e6:8.2f} speedup={baseline / seconds:5.2f}'
+        )
@@ -0,0 +1,46 @@
+#! /usr/bin/env python
+"""Compare the per message cost of a fresh JSONEncoder, single canonicalize calls, and the batch API canonicalize_many.
+
+The baseline fresh_encoder builds a new JSONEncoder (and thus its encode functions) per message, single calls reuse
+the pre-built module level encoder, and the batch API reuses one encode function for all messages.
+"""
+import os
+import sys
+import timeit
+
+import tallipoika.api as api
+
+MESSAGES = int(os.getenv('BENCH_MESSAGES', '100000'))
+REPEAT = int(os.getenv('BENCH_REPEAT', '5'))
+
+messages = [
+    {'id': n, 'kind': 'event', 'ok': n % 2 == 0, 'value': n / 8, 'tags': ['a', 'b'], 'ref': None}
+    for n in range(MESSAGES)
+]
+print(f'corpus: {MESSAGES} small messages, best of {REPEAT} runs', file=sys.stderr)
+
+
+def fresh_encoder() -> None:
+    for message in messages:
+        api.JSONEncoder(sort_keys=True).encode_utf8(message)
+
+
+def single() -> None:
+    for message in messages:
+        api.canonicalize(message)
+
+
+def batch() -> None:
+    for _ in api.canonicalize_many(messages):
+        pass
+
+
+results = {}
+for name, function in (('fresh_encoder', fresh_encoder), ('canonicalize', single), ('canonicalize_many', batch)):
+    seconds = min(timeit.repeat(function, number=1, repeat=REPEAT))
+    results[name] = seconds
+    print(f'{name:>27}: {seconds:8.3f} s total {1e6 * seconds / MESSAGES:8.3f} us per message')
+
+for baseline in ('fresh_encoder', 'canonicalize'):
+    saved = results[baseline] - results['canonicalize_many']
+    print(f'{"saved vs " + baseline:>27}: {1e6 * saved / MESSAGES:8.3f} us per message')
@@ -0,0 +1,262 @@
+#! /usr/bin/env python
+"""Time the serializers on synthetic corpora against json.dumps and compare the results with a baseline run.
+
+Usage: bench_suite.py [--scale FACTOR] [--repeat N] [--jobs N] [--output current.json] [--baseline baseline.json]
+
+The results are written as JSON (seconds per case and corpus plus some facts about the run) so runs for
+different commits can be compared with --baseline (the ratio current / baseline is reported per case).
+The aio.gap_* cases report the longest gap in seconds seen by a ticker task on the event loop while the records
+are encoded (blocking, cooperative, or offloaded to a thread) instead of the time of the encoding.
+"""
+import argparse
+import array
+import asyncio
+import datetime as dti
+import io
+import json
+import os
+import pathlib
+import platform
+import random
+import subprocess  # nosec B404
+import sys
+import tempfile
+import time
+import timeit
+
+import tallipoika.aio as aio
+import tallipoika.api as api
+import tallipoika.cli as cli
+import tallipoika.document as document
+import tallipoika.merkle as merkle
+import tallipoika.py2es6 as py2es6
+
+ENCODING = 'utf-8'
+SCALE = float(os.getenv('BENCH_SCALE', '1'))
+REPEAT = int(os.getenv('BENCH_REPEAT', '5'))
+JOBS = int(os.getenv('BENCH_JOBS', '0'))  # worker processes of the parallel cases (0 for one per CPU)
+TICK = 0.001  # period of the ticker task of the aio cases in seconds
+SEED = 42
+SLOWER_THRESHOLD = 1.1
+EDITS = 10
+UNICODE_ALPHABET = 'aäöüßéœ€𝄞日本語 "\\\t'
+
+
+def scaled(count: int) -> int:
+    """Return the count scaled by the requested factor but at least 1."""
+    return max(1, int(count * SCALE))
+
+
+def corpora() -> dict[str, object]:
+    """Return the synthetic corpora per name (deterministic per SEED and SCALE)."""
+    rng = random.Random(SEED)
+    numbers = [rng.uniform(-1e6, 1e6) for _ in range(scaled(50_000))]
+    numbers += [rng.randint(-(2**60), 2**60) for _ in range(scaled(25_000))]
+    numbers += [rng.choice((1e-7, 5e-324, 1e21, 123456789012345680000.0, 0.1, -0.0)) for _ in range(scaled(5_000))]
+    strings = [
+        ''.join(rng.choice(UNICODE_ALPHABET) for _ in range(rng.randint(1, 64))) for _ in range(scaled(20_000))
+    ]
+    wide = {f'key-{rng.getrandbits(32):08x}-{n}': n for n in range(scaled(50_000))}
+    deep = 'leaf'
+    for level in range(500):
+        deep = {'level': level, 'next': deep} if level % 2 else [deep, level]
+    records = [
+        {'id': n, 'kind': 'event', 'ok': n % 3 == 0, 'value': n / 7, 'tags': ['a', 'b'], 'ref': None}
+        for n in range(scaled(50_000))
+    ]
+    return {
+        'numbers': numbers,
+        'strings': strings,
+        'wide': wide,
+        'deep': [deep] * scaled(50),
+        'records': records,
+    }
+
+
+def best_of(function) -> float:
+    """Return the best time in seconds of REPEAT single runs."""
+    return min(timeit.repeat(function, number=1, repeat=REPEAT))
+
+
+def run_cli(data, folder: pathlib.Path) -> float:
+    """Return the best time of the command line interface canonicalizing data from a file (lines per record)."""
+    if isinstance(data, list) and all(isinstance(record, dict) for record in data):
+        in_path = folder / 'corpus.jsonl'
+        in_path.write_text(''.join(json.dumps(record) + '\n' for record in data), encoding=ENCODING)
+        argv = ['-s', '--lines', '-o', os.devnull, str(in_path)]
+    else:
+        in_path = folder / 'corpus.json'
+        in_path.write_text(json.dumps(data), encoding=ENCODING)
+        argv = ['-s', '-o', os.devnull, str(in_path)]
+    return best_of(lambda: cli.app(argv))
+
+
+def measure(corpus: str, data) -> dict[str, float]:
+    """Return the best times per case for the corpus."""
+    results = {
+        'json.dumps': best_of(lambda: json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False)),
+        'api.canonicalize': best_of(lambda: api.canonicalize(data)),
+        'api.serialize': best_of(lambda: api.serialize(data)),
+        'api.canonicalize_text': canonicalize_text(data),
+    }
+    if corpus == 'numbers':
+        results['py2es6.serialize'] = best_of(lambda: [py2es6.serialize(number) for number in data])
+        results['repr'] = best_of(lambda: [repr(number) for number in data])
+        samples = array.array('d', data)
+        results['api.canonicalize_array'] = best_of(lambda: api.canonicalize(samples))
+    if corpus == 'records':
+        results['api.canonicalize_many'] = best_of(lambda: list(api.canonicalize_many(data)))
+        results['document.edit_digest'] = edit_digest(data)
+        results.update(aio_gaps(data))
+    if corpus in ('records', 'wide'):
+        results['api.canonicalize_parallel'] = best_of(lambda: api.canonicalize(data, jobs=JOBS))
+    if corpus in ('wide', 'deep'):
+        results['merkle.digest_tree'] = best_of(lambda: merkle.digest_tree(data))
+        results['merkle.diff'] = merkle_diff(data)
+    with tempfile.TemporaryDirectory() as folder:
+        results['cli'] = run_cli(data, pathlib.Path(folder))
+    return results
+
+
+def canonicalize_text(data) -> float:
+    """Return the best time to canonicalize the JSON text of data incrementally (without loading it)."""
+    text = json.dumps(data)
+    return best_of(lambda: b''.join(api.canonicalize_text(io.StringIO(text))))
+
+
+class NullWriter:
+    """Stream writer discarding the data."""
+
+    def write(self, data: bytes) -> None:
+        pass
+
+    async def drain(self) -> None:
+        pass
+
+
+async def worst_gap(encode) -> float:
+    """Return the longest gap between the ticks of a ticker task while the encode coroutine runs."""
+    gaps = [0.0]
+    done = asyncio.Event()
+
+    async def ticker() -> None:
+        last = time.perf_counter()
+        while not done.is_set():
+            await asyncio.sleep(TICK)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(TICK)
+    await encode()
+    done.set()
+    await task
+    return max(gaps)
+
+
+def aio_gaps(data) -> dict[str, float]:
+    """Return the best worst gaps of the event loop while data is encoded blocking, cooperatively, and offloaded."""
+
+    async def blocking() -> None:
+        api.canonicalize(data)
+
+    async def cooperative() -> None:
+        await aio.canonicalize_to(NullWriter(), data)
+
+    async def offloaded() -> None:
+        await aio.canonicalize_to(NullWriter(), data, offload=True)
+
+    cases = {'aio.gap_blocking': blocking, 'aio.gap_cooperative': cooperative, 'aio.gap_offload': offloaded}
+    return {case: min(asyncio.run(worst_gap(encode)) for _ in range(REPEAT)) for case, encode in cases.items()}
+
+
+def edit_digest(data: list) -> float:
+    """Return the best time per edit of a record followed by the digest of the canonical document."""
+    canonical = document.CanonicalDocument({'records': data})
+    step = max(1, len(data) // EDITS)
+
+    def edits() -> None:
+        for index in range(0, step * EDITS, step):
+            canonical.replace(f'/records/{index}/value', index)
+            canonical.digest()
+
+    return best_of(edits) / EDITS
+
+
+def merkle_diff(data) -> float:
+    """Return the best time to find the single changed value between the digest trees of data and a variant."""
+    if isinstance(data, dict):
+        variant = {**data, next(iter(data)): 'changed'}
+    else:
+        variant = [*data[:-1], 'changed']
+    left, right = merkle.digest_tree(data), merkle.digest_tree(variant)
+    return best_of(lambda: merkle.diff(left, right))
+
+
+def git_revision() -> str:
+    """Return the short hash of the checked out commit if available."""
+    try:
+        return subprocess.run(  # nosec B603 B607
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, check=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def compare(current: dict, baseline: dict) -> None:
+    """Print the ratio current / baseline per corpus and case present in both runs."""
+    print(f'comparison with baseline from revision {baseline.get("revision") or "unknown"}:')
+    for corpus, cases in current['results'].items():
+        for case, seconds in cases.items():
+            before = baseline.get('results', {}).get(corpus, {}).get(case)
+            if not before:
+                continue
+            ratio = seconds / before
+            flag = ' SLOWER' if ratio > SLOWER_THRESHOLD else ''
+            print(f'{corpus:>8} {case:>25}: {before:8.4f} s -> {seconds:8.4f} s ratio={ratio:5.2f}{flag}')
+
+
+def main(argv: list[str]) -> int:
+    """Run the suite, write the results if requested, and compare with the baseline if present."""
+    global JOBS, REPEAT, SCALE
+    parser = argparse.ArgumentParser(prog='bench_suite', description='Benchmark suite for tallipoika.')
+    parser.add_argument('--scale', type=float, default=SCALE, help='size factor for the corpora (default: 1)')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='runs per case of which the best counts')
+    parser.add_argument('--jobs', type=int, default=JOBS, help='worker processes of the parallel cases (0 per CPU)')
+    parser.add_argument('--output', default='', help='path to write the results as JSON to')
+    parser.add_argument('--baseline', default='', help='path to the results of an earlier run to compare with')
+    options = parser.parse_args(argv)
+    SCALE, REPEAT, JOBS = options.scale, options.repeat, options.jobs
+
+    current = {
+        'revision': git_revision(),
+        'timestamp': dti.datetime.now(tz=dti.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'scale': SCALE,
+        'repeat': REPEAT,
+        'jobs': JOBS or os.cpu_count() or 1,
+        'results': {},
+    }
+    for corpus, data in corpora().items():
+        current['results'][corpus] = cases = measure(corpus, data)
+        baseline = cases['json.dumps']
+        for case, seconds in cases.items():
+            print(f'{corpus:>8} {case:>25}: {seconds:8.4f} s ({seconds / baseline:6.2f} x json.dumps)')
+
+    if options.output:
+        pathlib.Path(options.output).write_text(json.dumps(current, indent=2) + '\n', encoding=ENCODING)
+        print(f'results written to {options.output}', file=sys.stderr)
+    if options.baseline:
+        baseline_path = pathlib.Path(options.baseline)
+        if baseline_path.is_file():
+            compare(current, json.loads(baseline_path.read_text(encoding=ENCODING)))
+        else:
+            print(f'no baseline at {options.baseline} (create one with make bench-baseline)', file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,29 @@
+#! /usr/bin/env python
+"""Compare full circular reference tracking with the trusted input mode on wide and deep container structures."""
+import os
+import sys
+import timeit
+
+import tallipoika.api as api
+
+WIDTH = int(os.getenv('BENCH_WIDTH', '100000'))
+DEPTH = int(os.getenv('BENCH_DEPTH', '200'))
+REPEAT = int(os.getenv('BENCH_REPEAT', '5'))
+
+wide = [{'id': n, 'tags': ['a', 'b'], 'pos': [n, -n]} for n in range(WIDTH)]
+deep = [0]
+for _ in range(DEPTH):
+    deep = [{'next': deep, 'leaf': [1, 2]}]
+corpora = {'wide': wide, 'deep': [deep] * (WIDTH // (2 * DEPTH) or 1)}
+encoders = {
+    'markers': api.JSONEncoder(check_circular=True),
+    'trusted': api.JSONEncoder(trusted=True, max_depth=max(api.MAX_DEPTH, 2 * DEPTH + 2)),
+}
+print(f'corpora: wide {WIDTH} records, deep {DEPTH} levels; best of {REPEAT} runs', file=sys.stderr)
+
+for corpus, data in corpora.items():
+    results = {}
+    for mode, encoder in encoders.items():
+        results[mode] = seconds = min(timeit.repeat(lambda: encoder.encode_utf8(data), number=1, repeat=REPEAT))
+        print(f'{corpus:>5} {mode:>8}: {seconds:8.3f} s')
+    print(f'{corpus:>5} {"speedup":>8}: {results["markers"] / results["trusted"]:8.2f}')
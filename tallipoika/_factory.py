@@ -1,10 +1,17 @@
 """Special factory for iterencode function covering some use cases in the tallipoika JSONEncoder."""
 
+import array
+import functools
+import itertools
+import sys
+import time
 from typing import no_type_check
 
 import tallipoika.py2es6 as py2es6
 
 ENCODING_FOR_SORT = 'utf-16_be'
+SHAPE_CACHE_SIZE = 1024
+SHAPE_CACHE_MAX_KEYS = 256
 SPACE = ' '
 OPEN_SB = '['
 CLOSE_SB = ']'
@@ -13,25 +20,726 @@ OPEN_CB = '{'
 CLOSE_CB = '}'
 EMPTY_OBJECT_REP = f'{OPEN_CB}{CLOSE_CB}'
 NL = '\n'
+ITER_CHUNK_TOKENS = 256
+NEVER_FLUSH = ()  # the empty sized buffer never reaches the flush limit
+# The one-shot engine recurses this deep at most and hands deeper containers over to the explicit stack walk
+RECURSION_DEPTH = 256
+UNLIMITED_DEPTH = sys.maxsize
 
 JSON_FALSE_REP = 'false'
 JSON_NULL_REP = 'null'
 JSON_TRUE_REP = 'true'
 JSON_FNT_MAP = {None: JSON_NULL_REP, True: JSON_TRUE_REP, False: JSON_FALSE_REP}
 
+OPEN_SB_UTF8 = OPEN_SB.encode()
+CLOSE_SB_UTF8 = CLOSE_SB.encode()
+EMPTY_ARRAY_REP_UTF8 = EMPTY_ARRAY_REP.encode()
+OPEN_CB_UTF8 = OPEN_CB.encode()
+CLOSE_CB_UTF8 = CLOSE_CB.encode()
+EMPTY_OBJECT_REP_UTF8 = EMPTY_OBJECT_REP.encode()
+NL_UTF8 = NL.encode()
+JSON_FNT_MAP_UTF8 = {atom: rep.encode() for atom, rep in JSON_FNT_MAP.items()}
+NONE_TYPE = type(None)
+# Values of these types (and of their subclasses) are encoded without the default hook
+ENCODABLE_TYPES = (str, int, float, list, tuple, dict)
+
+STATS_CONTAINERS = 'containers'
+STATS_KEYS_SORTED = 'keys_sorted'
+STATS_NUMBERS = 'numbers'
+STATS_STRINGS = 'strings'
+STATS_DEFAULT_CALLS = 'default_calls'
+STATS_BYTES_EMITTED = 'bytes_emitted'
+STATS_SORT_SECONDS = 'sort_seconds'
+STATS_FORMAT_SECONDS = 'format_seconds'
+STATS_COUNTERS = (
+    STATS_CONTAINERS,
+    STATS_KEYS_SORTED,
+    STATS_NUMBERS,
+    STATS_STRINGS,
+    STATS_DEFAULT_CALLS,
+    STATS_BYTES_EMITTED,
+)
+STATS_TIMERS = (STATS_SORT_SECONDS, STATS_FORMAT_SECONDS)
+# Arrays of at least this many items whose types share one formatter are encoded in bulk (cf. bulk_encoder)
+BULK_MIN_ITEMS = 16
+# The walk emits bulk encoded arrays in slices of this many items, so the chunks of iterencode stay bounded
+BULK_SLICE_ITEMS = 64
+# The one-shot engine joins bulk encoded arrays in slices of this many items to bound the transient representations
+BULK_JOIN_ITEMS = 4096
+# One-dimensional buffers of these native formats (typecodes) are encoded as arrays of their numbers
+BUFFER_TYPES = frozenset((array.array, memoryview))
+BUFFER_ITEM_TYPES = {**dict.fromkeys('bBhHiIlLqQnN', int), **dict.fromkeys('fd', float)}
+NATIVE_FORMAT_PREFIX = '@'
+# Tuples of values with exactly these types are immutable and can be cached per content across calls
+CONTENT_TYPES = frozenset((str, int, float, bool, NONE_TYPE))
+
+
+@no_type_check
+def stringify_key(key, _skip_keys):
+    """Return the member name for key as string or None if the key shall be skipped."""
+    if isinstance(key, str):
+        return key
+    # JavaScript is weakly typed for these, so it makes sense to also allow them.
+    # Many encoders seem to do something like this.
+    if isinstance(key, (float, int)):
+        # see comment for float/int in _make_iterencode
+        return py2es6.serialize(key)
+    if key is None:
+        return JSON_NULL_REP
+    if _skip_keys:
+        return None
+    raise TypeError(f'key {repr(key)} is not a string')
+
+
+@no_type_check
+def scalar_handlers(_encoder, _serialize, _fnt_map):
+    """Return the table mapping the exact builtin scalar types to their handlers.
+
+    Looking up type(value) in this table is the fast path of the engines (no allocations, no isinstance chains).
+    Instances of subclasses miss the table and take the subclass-aware fallback path.
+    """
+    _atom = _fnt_map.__getitem__
+    return {str: _encoder, int: _serialize, float: _serialize, bool: _atom, NONE_TYPE: _atom}
+
+
+@no_type_check
+def _dict_shape(keys, _encoder, _key_separator, _sort_keys, _skip_keys, _lead, _separator):
+    """Return the keys of a dict in output order and the matching member prefixes.
+
+    The member prefix is the lead (e.g. the opening brace) for the first and the separator for all other members
+    followed by the encoded member name and the key separator (all str or bytes as per the encoder and separators).
+    The names are stringified before sorting, so non-string keys take their place per their JSON representation.
+    """
+    members = []
+    for key in keys:
+        name = stringify_key(key, _skip_keys)
+        if name is not None:
+            members.append((name, key))
+    if _sort_keys:
+        members.sort(key=lambda nk: nk[0].encode(ENCODING_FOR_SORT))
+    prefixes = tuple(
+        (_separator if ndx else _lead) + _encoder(name) + _key_separator for ndx, (name, _) in enumerate(members)
+    )
+    return tuple(key for _, key in members), prefixes
+
+
+# Records sharing a schema share the key tuple, so every distinct shape is sorted and escaped only once per process.
+# Equal but differently typed keys (1, 1.0, True) share an entry, which is fine as their member names are equal.
+_cached_dict_shape = functools.lru_cache(maxsize=SHAPE_CACHE_SIZE)(_dict_shape)
+
+
+@no_type_check
+def dict_shape(assoc, _encoder, _key_separator, _sort_keys, _skip_keys, _lead, _separator):
+    """Return the keys of assoc in output order and the matching member prefixes - cached unless the dict is wide."""
+    keys = tuple(assoc)
+    if len(keys) > SHAPE_CACHE_MAX_KEYS:
+        return _dict_shape(keys, _encoder, _key_separator, _sort_keys, _skip_keys, _lead, _separator)
+    return _cached_dict_shape(keys, _encoder, _key_separator, _sort_keys, _skip_keys, _lead, _separator)
+
+
+@no_type_check
+def shape_cache_info():
+    """Return the hits, misses, maxsize, and currsize of the dict shape cache as named tuple."""
+    return _cached_dict_shape.cache_info()
+
+
+@no_type_check
+def shape_cache_clear():
+    """Clear the dict shape cache and reset its statistics."""
+    _cached_dict_shape.cache_clear()
+
+
+@no_type_check
+def new_stats():
+    """Return a statistics dict with all counters and timers set to zero."""
+    return {**dict.fromkeys(STATS_COUNTERS, 0), **dict.fromkeys(STATS_TIMERS, 0.0)}
+
+
+@no_type_check
+def count_calls(function, _stats, _counter, _timer=None, _clock=time.perf_counter):
+    """Return function wrapped to increment the counter (and to add the time spent to the timer) in _stats per call."""
+    if _timer is None:
+
+        @no_type_check
+        def _counted(*args):
+            _stats[_counter] += 1
+            return function(*args)
+
+        return _counted
+
+    @no_type_check
+    def _timed(*args):
+        _stats[_counter] += 1
+        start = _clock()
+        try:
+            return function(*args)
+        finally:
+            _stats[_timer] += _clock() - start
+
+    return _timed
+
+
+@no_type_check
+def count_found(lookup, _stats, _counter):
+    """Return the lookup function wrapped to increment the counter in _stats whenever it finds an entry."""
+
+    @no_type_check
+    def _counted(key):
+        entry = lookup(key)
+        if entry is not None:
+            _stats[_counter] += 1
+        return entry
+
+    return _counted
+
+
+@no_type_check
+def timed_dict_shape(_stats, _clock=time.perf_counter):
+    """Return a drop-in for dict_shape adding the time spent to the sort timer and the keys actually sorted.
+
+    Keys of shapes served from the shape cache count as not sorted (the cache is what saves that time).
+    """
+    cache_info = _cached_dict_shape.cache_info
+
+    @no_type_check
+    def _shape(assoc, _encoder, _key_separator, _sort_keys, _skip_keys, _lead, _separator):
+        misses = cache_info().misses
+        start = _clock()
+        keys, prefixes = dict_shape(assoc, _encoder, _key_separator, _sort_keys, _skip_keys, _lead, _separator)
+        _stats[STATS_SORT_SECONDS] += _clock() - start
+        if _sort_keys and (len(assoc) > SHAPE_CACHE_MAX_KEYS or cache_info().misses > misses):
+            _stats[STATS_KEYS_SORTED] += len(keys)
+        return keys, prefixes
+
+    return _shape
+
+
+@no_type_check
+def instrument(_stats, _encoder, _serialize, _default):
+    """Return the string encoder, number serializer, default hook, and dict shape function to build an engine with.
+
+    Without _stats (None) the functions are returned as is, so engines built without statistics pay nothing.
+    Otherwise the functions are wrapped to count (and time) their calls into _stats.
+    """
+    if _stats is None:
+        return _encoder, _serialize, _default, dict_shape
+    return (
+        count_calls(_encoder, _stats, STATS_STRINGS, STATS_FORMAT_SECONDS),
+        count_calls(_serialize, _stats, STATS_NUMBERS, STATS_FORMAT_SECONDS),
+        count_calls(_default, _stats, STATS_DEFAULT_CALLS),
+        timed_dict_shape(_stats),
+    )
+
+
+@no_type_check
+def tuple_content_key(value):
+    """Return the content cache key for a tuple of exactly typed builtin scalars and None for other tuples.
+
+    The types are part of the key, as the tuples (1,), (1.0,), and (True,) are equal but encode differently.
+    """
+    types = tuple(map(type, value))
+    for item_type in types:
+        if item_type not in CONTENT_TYPES:
+            return None
+    return value, types
+
+
+@no_type_check
+def make_fragment_cache(_encode, _maxsize, _empty):
+    """Return the LRU cached function mapping a tuple content key to its fragment per the one-shot _encode."""
+
+    @functools.lru_cache(maxsize=_maxsize)
+    @no_type_check
+    def _fragment(key):
+        parts = []
+        _encode(key[0], parts.append)
+        return _empty.join(parts)
+
+    return _fragment
+
+
+@no_type_check
+def memoizing(make, _fragment=None):
+    """Return an encode function that builds a memoizing engine per call with make.
+
+    The memo is a triple of the fragments and the seen containers (both keyed by identity and holding on to the
+    objects, so no identity is reused while the call lasts) plus the optional cross call _fragment cache function.
+    """
+
+    @no_type_check
+    def _encode_memoized(obj, *args):
+        return make(_memo=({}, {}, _fragment))(obj, *args)
+
+    return _encode_memoized
+
+
+@no_type_check
+def memoize_container(encode_container, _memo, _indented, _empty):
+    """Return the container encode function of the one-shot engine wrapped to reuse fragments of repeated objects.
+
+    The first occurrence of a container is encoded as usual, the second into a fragment that is kept for the
+    remaining occurrences. So containers occurring once pay for the bookkeeping but not for an extra copy.
+    """
+    fragments, seen, _ = _memo
+
+    @no_type_check
+    def _encode_memoized(obj, _current_indent_level, append, markers):
+        if not obj:
+            return encode_container(obj, _current_indent_level, append, markers)
+        key = (id(obj), _current_indent_level) if _indented else id(obj)
+        known = fragments.get(key)
+        if known is not None:
+            return append(known[1])
+        if key not in seen:
+            seen[key] = obj
+            return encode_container(obj, _current_indent_level, append, markers)
+        parts = []
+        encode_container(obj, _current_indent_level, parts.append, markers)
+        fragment = _empty.join(parts)
+        fragments[key] = (obj, fragment)
+        append(fragment)
+
+    return _encode_memoized
+
+
+@no_type_check
+def cache_tuple_content(encode_container, _fragment):
+    """Return the container encode function wrapped to serve tuples of builtin scalars from the _fragment cache."""
+
+    @no_type_check
+    def _encode_tuple(obj, _current_indent_level, append, markers):
+        key = tuple_content_key(obj)
+        if key is None:
+            return encode_container(obj, _current_indent_level, append, markers)
+        append(_fragment(key))
+
+    return _encode_tuple
+
+
+@no_type_check
+def buffer_item_type(value):
+    """Return the type of the items (int or float) of a numeric array.array or one-dimensional memoryview else None."""
+    if type(value) is array.array:
+        return BUFFER_ITEM_TYPES.get(value.typecode)
+    if type(value) is memoryview and value.ndim == 1:
+        return BUFFER_ITEM_TYPES.get(value.format.removeprefix(NATIVE_FORMAT_PREFIX))
+    return None
+
+
+@no_type_check
+class _Raw:
+    """Type of the marker value of walk members that are completely represented by their prefix."""
+
+    __slots__ = ()
+
+
+RAW = _Raw()
+
+
+@no_type_check
+class _Capture:
+    """Closing token of a repeated container whose output the walk records as fragment for the later occurrences."""
+
+    __slots__ = ('close', 'key', 'value')
+
+    @no_type_check
+    def __init__(self, close, key, value):
+        self.close = close
+        self.key = key
+        self.value = value
+
+
+@no_type_check
+def bulk_encoder(_encoder, _utf8):
+    """Return the function selecting the bulk encoder for the items of an array of scalars sharing one formatter.
+
+    The selected encoder is called with a sequence and the item separator (bytes if _utf8 else str) and returns the
+    representations of all items joined by the separator.
+    The selection is None if the items need the per item path
+    (short arrays, containers, subclasses, or different formatters like strings mixed with numbers).
+    Numeric buffers (cf. buffer_item_type) select per their format, so their items are formatted straight from the
+    buffer without an intermediate list.
+    The formatter (escaper, ES6 number formatter, or literal lookup) is mapped over the whole run and joined once,
+    so neither the dispatch per item nor the append per token remain (UTF-8 output is encoded once per run).
+    """
+    _atoms = functools.partial(map, JSON_FNT_MAP.__getitem__)
+    joiners = {
+        frozenset((str,)): lambda seq, separator: separator.join(map(_encoder, seq)),
+        frozenset((float,)): py2es6.join_floats,
+        frozenset((int,)): py2es6.join_ints,
+        frozenset((int, float)): lambda seq, separator: separator.join(map(py2es6.serialize, seq)),
+        frozenset((bool,)): lambda seq, separator: separator.join(_atoms(seq)),
+        frozenset((NONE_TYPE,)): lambda seq, separator: separator.join(_atoms(seq)),
+        frozenset((bool, NONE_TYPE)): lambda seq, separator: separator.join(_atoms(seq)),
+    }
+    if _utf8:
+        joiners = {
+            types: functools.partial(lambda join, seq, separator: join(seq, separator.decode()).encode(), join)
+            for types, join in joiners.items()
+        }
+    _joiner = joiners.get
+
+    @no_type_check
+    def _bulk(seq):
+        if type(seq) in BUFFER_TYPES:  # the format tells the item type without touching the items
+            return _joiner(frozenset((buffer_item_type(seq),)))
+        if len(seq) < BULK_MIN_ITEMS:
+            return None
+        return _joiner(frozenset(map(type, seq)))
+
+    return _bulk
+
+
+@functools.lru_cache(maxsize=None)
+@no_type_check
+def utf8_encoder(_encoder):
+    """Return a (stable per _encoder) function returning the UTF-8 encoded JSON representation of a Python string."""
+
+    @no_type_check
+    def _utf8_encoder(text):
+        return _encoder(text).encode()
+
+    return _utf8_encoder
+
+
+@no_type_check
+def _utf8_serialize(number):
+    """Return the ECMAScript v6 representation of number as (ASCII) bytes."""
+    return py2es6.serialize(number).encode()
+
+
+@no_type_check
+def depth_bound(_check_circular, _max_depth):
+    """Return the nesting depth (and number of default hook calls in a row) beyond which the engines raise ValueError.
+
+    Without circular reference markers the depth is the only guard against circular references, so it defaults to the
+    recursion limit of the interpreter (where recursive encoders raise RecursionError) instead of being unlimited.
+    """
+    if _max_depth is not None:
+        return _max_depth
+    return UNLIMITED_DEPTH if _check_circular else sys.getrecursionlimit()
+
+
+@no_type_check
+def make_walk(
+    _check_circular,
+    _default,
+    _encoder,
+    _indent,
+    _key_separator,
+    _item_separator,
+    _sort_keys,
+    _skip_keys,
+    _utf8,
+    _max_depth=None,
+    _stats=None,
+    _memo=None,
+    # HACK: hand-optimized bytecode; turn globals into locals
+    ValueError=ValueError,
+    dict=dict,
+    float=float,
+    id=id,
+    int=int,
+    isinstance=isinstance,
+    len=len,
+    list=list,
+    str=str,
+    tuple=tuple,
+    type=type,
+    zip=zip,
+    _chain=itertools.chain,
+    _repeat=itertools.repeat,
+):
+    """Return the walk generator function that encodes a Python data structure with an explicit stack of frames.
+
+    Every frame holds an iterator over (prefix, value) pairs of a container, the closing token, and the ids of
+    the objects to remove from the circular reference markers when the container is closed.
+    Entering a container pushes the current frame and leaving it pops the parent frame, so the work per token
+    does not depend on the nesting depth and the recursion limit of the interpreter does not apply.
+
+    The walk is called with the object, the append function of the sink, a sized buffer, a limit, the nesting level,
+    and the circular reference markers (None if not checked).
+    It yields (without value) whenever the length of the buffer reached the limit, so the caller can flush it.
+    Callers that do not want to flush pass NEVER_FLUSH as buffer and a positive limit.
+
+    If _utf8 is true, all representations are emitted as UTF-8 encoded bytes (separators, literals, and member names
+    included) instead of str, so the sink may also be the extend method of a bytearray.
+
+    Nesting containers (or calls of the default hook) deeper than per depth_bound raises a ValueError.
+    If _stats is not None, the work done is counted into that statistics dict (cf. new_stats).
+    If _memo is not None, repeated containers are encoded once per call (cf. memoizing and memoize_container).
+    """
+    if _indent is not None and not isinstance(_indent, str):
+        _indent = SPACE * _indent
+    depth_limit = depth_bound(_check_circular, _max_depth)
+    # the statistics count per item, so the instrumented engines keep the per item path
+    _bulk = bulk_encoder(_encoder, _utf8) if _stats is None else None
+
+    _serialize = py2es6.serialize
+    empty, nl, fnt_map = '', NL, JSON_FNT_MAP
+    open_sb, close_sb, empty_array_rep = OPEN_SB, CLOSE_SB, EMPTY_ARRAY_REP
+    open_cb, close_cb, empty_object_rep = OPEN_CB, CLOSE_CB, EMPTY_OBJECT_REP
+    if _utf8:
+        _encoder, _serialize = utf8_encoder(_encoder), _utf8_serialize
+        _key_separator, _item_separator = _key_separator.encode(), _item_separator.encode()
+        _indent = None if _indent is None else _indent.encode()
+        empty, nl, fnt_map = b'', NL_UTF8, JSON_FNT_MAP_UTF8
+        open_sb, close_sb, empty_array_rep = OPEN_SB_UTF8, CLOSE_SB_UTF8, EMPTY_ARRAY_REP_UTF8
+        open_cb, close_cb, empty_object_rep = OPEN_CB_UTF8, CLOSE_CB_UTF8, EMPTY_OBJECT_REP_UTF8
+    _key_encoder = _encoder
+    _encoder, _serialize, _default, _shape = instrument(_stats, _encoder, _serialize, _default)
+
+    flat_tokens = (open_sb, open_cb, _item_separator, close_sb, close_cb)
+    level_tokens = {}
+
+    @no_type_check
+    def _tokens(level):
+        """Return the list lead, dict lead, separator, list close, and dict close for the nesting level."""
+        if _indent is None:
+            return flat_tokens
+        tokens = level_tokens.get(level)
+        if tokens is None:
+            newline_indent, closing_indent = nl + _indent * level, nl + _indent * (level - 1)
+            tokens = level_tokens[level] = (
+                open_sb + newline_indent,
+                open_cb + newline_indent,
+                _item_separator + newline_indent,
+                closing_indent + close_sb,
+                closing_indent + close_cb,
+            )
+        return tokens
+
+    @no_type_check
+    def _open_list(seq, level):
+        lead, _, separator, close, _ = _tokens(level)
+        join = None if _bulk is None else _bulk(seq)
+        if join is not None:
+            if len(seq) <= BULK_SLICE_ITEMS:
+                return iter(()), lead + join(seq, separator) + close
+            return _bulk_members(join, seq, lead, separator), close
+        return zip(_chain((lead,), _repeat(separator)), seq), close
+
+    @no_type_check
+    def _bulk_members(join, seq, lead, separator):
+        """Yield the members of the bulk encoded slices of seq - the prefix carries the slice and RAW is the value."""
+        for start in range(0, len(seq), BULK_SLICE_ITEMS):
+            yield (separator if start else lead) + join(seq[start : start + BULK_SLICE_ITEMS], separator), RAW
+
+    @no_type_check
+    def _open_dict(assoc, level):
+        _, lead, separator, _, close = _tokens(level)
+        keys, prefixes = _shape(assoc, _key_encoder, _key_separator, _sort_keys, _skip_keys, lead, separator)
+        if not keys:  # all keys skipped
+            return iter(()), empty_object_rep
+        return zip(prefixes, map(assoc.__getitem__, keys)), close
+
+    @no_type_check
+    def _memoize(opener):
+        """Return the opener wrapped to reuse the fragments of repeated containers (cf. memoize_container)."""
+        fragments, seen, _ = _memo
+
+        @no_type_check
+        def _open_memoized(value, level):
+            key = (id(value), level - 1) if _indent is not None else id(value)
+            known = fragments.get(key)
+            if known is not None:
+                return iter(()), known[1]
+            members, close = opener(value, level)
+            if key not in seen:
+                seen[key] = value
+                return members, close
+            # the second occurrence is walked on the same stack while the walk records its output
+            return members, _Capture(close, key, value)
+
+        return _open_memoized
+
+    @no_type_check
+    def _cache_content(opener, _fragment):
+        """Return the opener wrapped to serve tuples of builtin scalars from the _fragment cache."""
+
+        @no_type_check
+        def _open_tuple(value, level):
+            key = tuple_content_key(value)
+            if key is None:
+                return opener(value, level)
+            return iter(()), _fragment(key)
+
+        return _open_tuple
+
+    list_entry, dict_entry = (_open_list, empty_array_rep), (_open_dict, empty_object_rep)
+    tuple_entry = list_entry
+    if _memo is not None:
+        list_entry, dict_entry = (_memoize(_open_list), empty_array_rep), (_memoize(_open_dict), empty_object_rep)
+        tuple_entry = list_entry if _memo[2] is None else (_cache_content(list_entry[0], _memo[2]), empty_array_rep)
+    scalar_handler = {**scalar_handlers(_encoder, _serialize, fnt_map), _Raw: lambda _: empty}.get
+    container_handler = {list: list_entry, tuple: tuple_entry, dict: dict_entry}.get
+    if _stats is not None:
+        container_handler = count_found(container_handler, _stats, STATS_CONTAINERS)
+
+    @no_type_check
+    def _fallback(value, markers, default_ids):
+        """Resolve a value whose exact type is not in the dispatch tables to a representation or container entry.
+
+        The objects handed to the default hook stay in the markers until the resulting container is closed.
+        """
+        hops = 0
+        while True:
+            if isinstance(value, str):
+                return _encoder(value), None
+            if value is None or value is True or value is False:
+                return fnt_map[value], None
+            if isinstance(value, (float, int)):
+                # Subclasses of float and int may override __str__, but should still serialize as numbers in JSON.
+                # One example within the standard library is IntEnum.
+                return _serialize(value), None
+            if isinstance(value, (list, tuple)):
+                if _stats is not None:
+                    _stats[STATS_CONTAINERS] += 1
+                return value, list_entry
+            if isinstance(value, dict):
+                if _stats is not None:
+                    _stats[STATS_CONTAINERS] += 1
+                return value, dict_entry
+            if type(value) in BUFFER_TYPES and buffer_item_type(value) is not None:
+                if _stats is not None:
+                    _stats[STATS_CONTAINERS] += 1
+                return value, list_entry
+            if markers is not None:
+                marker_id = id(value)
+                if marker_id in markers:
+                    raise ValueError('circular reference detected')
+                markers[marker_id] = value
+                default_ids.append(marker_id)
+            hops += 1
+            if hops > depth_limit:
+                raise ValueError(f'maximum depth of {depth_limit} exceeded in default hook calls')
+            value = _default(value)
+
+    @no_type_check
+    def _walk(obj, append, buf, limit, level, markers):
+        stack = []
+        captures = []  # the stack depth, parent append, parts, and capture per repeated container being recorded
+        members, close, marker_ids = zip((empty,), (obj,)), empty, ()
+        while True:
+            for prefix, value in members:
+                append(prefix)
+                handler = scalar_handler(type(value))
+                if handler is not None:
+                    append(handler(value))
+                else:
+                    entry = container_handler(type(value))
+                    default_ids = []
+                    if entry is None:
+                        value, entry = _fallback(value, markers, default_ids)
+                        if entry is None:
+                            append(value)
+                            for marker_id in default_ids:
+                                del markers[marker_id]
+                            continue
+                    opener, empty_rep = entry
+                    if value:
+                        if markers is not None:
+                            marker_id = id(value)
+                            if marker_id in markers:
+                                raise ValueError('circular reference detected')
+                            markers[marker_id] = value
+                            default_ids.append(marker_id)
+                        stack.append((members, close, marker_ids))
+                        level += 1
+                        if level > depth_limit:
+                            raise ValueError(f'maximum nesting depth of {depth_limit} exceeded')
+                        members, close = opener(value, level)
+                        if type(close) is _Capture:
+                            parts = []
+                            captures.append((len(stack), append, parts, close))
+                            append, close = parts.append, close.close
+                        marker_ids = default_ids
+                        break
+                    append(empty_rep)
+                    for marker_id in default_ids:
+                        del markers[marker_id]
+                if len(buf) >= limit:
+                    yield
+            else:
+                append(close)
+                if markers is not None:
+                    for marker_id in marker_ids:
+                        del markers[marker_id]
+                if captures and captures[-1][0] == len(stack):
+                    _, append, parts, capture = captures.pop()
+                    fragment = empty.join(parts)
+                    _memo[0][capture.key] = (capture.value, fragment)
+                    append(fragment)
+                if not stack:
+                    return
+                members, close, marker_ids = stack.pop()
+                level -= 1
+
+    return _walk
+
 
 @no_type_check
 def make_iterencode(
-    markers,
+    _check_circular,
     _default,
     _encoder,
     _indent,
-    _floatstr,
     _key_separator,
     _item_separator,
     _sort_keys,
     _skip_keys,
-    _one_shot,
+    _max_depth=None,
+    _stats=None,
+    _memo=None,
+):
+    """Return a generator function yielding the string representation in chunks of about ITER_CHUNK_TOKENS tokens.
+
+    The chunks are produced by a single explicit stack walk instead of a chain of nested generators,
+    so no chunk has to travel up through one generator frame per nesting level.
+    """
+    walk = make_walk(
+        _check_circular,
+        _default,
+        _encoder,
+        _indent,
+        _key_separator,
+        _item_separator,
+        _sort_keys,
+        _skip_keys,
+        False,
+        _max_depth,
+        _stats,
+        _memo,
+    )
+
+    @no_type_check
+    def _iterencode(obj, _current_indent_level):
+        # the markers are per call, so the returned function can be reused (also concurrently)
+        markers = {} if _check_circular else None
+        chunks = []
+        for _ in walk(obj, chunks.append, chunks, ITER_CHUNK_TOKENS, _current_indent_level, markers):
+            yield ''.join(chunks)
+            chunks.clear()
+        if chunks:
+            yield ''.join(chunks)
+
+    return _iterencode
+
+
+@no_type_check
+def make_encode(
+    _check_circular,
+    _default,
+    _encoder,
+    _indent,
+    _key_separator,
+    _item_separator,
+    _sort_keys,
+    _skip_keys,
+    _utf8=False,
+    _max_depth=None,
+    _stats=None,
+    _memo=None,
     # HACK: hand-optimized bytecode; turn globals into locals
     ValueError=ValueError,
     dict=dict,
@@ -42,160 +750,209 @@ def make_iterencode(
     list=list,
     str=str,
     tuple=tuple,
-    _intstr=int.__str__,
+    zip=zip,
 ):
+    """Return a one-shot encode function that emits all representations through a single append function.
+
+    In contrast to the generators of make_iterencode no chunk has to be joined and yielded.
+    The returned function is called with the object and the append function of the sink (like list.append).
+    All state of a call (the sink and the markers for circular reference checks) is passed down the recursion,
+    so the returned function can be built once and reused (also concurrently).
+    Containers nested deeper than RECURSION_DEPTH are handed over to the explicit stack walk of make_walk,
+    so the recursion limit of the interpreter does not apply.
+
+    If _utf8 is true, all representations are emitted as UTF-8 encoded bytes (separators, literals, and member names
+    included) instead of str, so the sink may also be the extend method of a bytearray.
+
+    Nesting containers deeper than per depth_bound raises a ValueError.
+    Together with _check_circular false this is the trusted input mode: an integer comparison per container
+    replaces the markers dict and still stops any circular reference.
+
+    If _stats is not None, the work done is counted into that statistics dict (cf. new_stats).
+    If _memo is not None, repeated containers are encoded once per call (cf. memoizing and memoize_container).
+    """
+    walk = make_walk(
+        _check_circular,
+        _default,
+        _encoder,
+        _indent,
+        _key_separator,
+        _item_separator,
+        _sort_keys,
+        _skip_keys,
+        _utf8,
+        _max_depth,
+        _stats,
+        _memo,
+    )
+    depth_limit = depth_bound(_check_circular, _max_depth)
+    # The level at which a container either exceeds the maximum depth or is handed over to the walk
+    guard_level = min(RECURSION_DEPTH, depth_limit)
     if _indent is not None and not isinstance(_indent, str):
         _indent = SPACE * _indent
+    _bulk = bulk_encoder(_encoder, _utf8) if _stats is None else None
+
+    _serialize = py2es6.serialize
+    open_sb, close_sb, empty_array_rep = OPEN_SB, CLOSE_SB, EMPTY_ARRAY_REP
+    open_cb, close_cb, empty_object_rep = OPEN_CB, CLOSE_CB, EMPTY_OBJECT_REP
+    empty, nl, fnt_map = '', NL, JSON_FNT_MAP
+    if _utf8:
+        _encoder, _serialize = utf8_encoder(_encoder), _utf8_serialize
+        _key_separator, _item_separator = _key_separator.encode(), _item_separator.encode()
+        _indent = None if _indent is None else _indent.encode()
+        open_sb, close_sb, empty_array_rep = OPEN_SB_UTF8, CLOSE_SB_UTF8, EMPTY_ARRAY_REP_UTF8
+        open_cb, close_cb, empty_object_rep = OPEN_CB_UTF8, CLOSE_CB_UTF8, EMPTY_OBJECT_REP_UTF8
+        empty, nl, fnt_map = b'', NL_UTF8, JSON_FNT_MAP_UTF8
+    _key_encoder = _encoder
+    _encoder, _serialize, _default, _shape = instrument(_stats, _encoder, _serialize, _default)
+
+    @no_type_check
+    def _descend(obj, _current_indent_level: int, append, markers):
+        if _current_indent_level >= depth_limit:
+            raise ValueError(f'maximum nesting depth of {depth_limit} exceeded')
+        if _stats is not None:
+            _stats[STATS_CONTAINERS] -= 1  # the walk counts the handed over container again
+        for _ in walk(obj, append, NEVER_FLUSH, 1, _current_indent_level, markers):
+            pass  # pragma: no cover
 
     @no_type_check
-    def _iterencode_list(seq, _current_indent_level: int):
+    def _encode_list(seq, _current_indent_level: int, append, markers):
         if not seq:
-            yield EMPTY_ARRAY_REP
+            append(empty_array_rep)
             return
+        if _current_indent_level >= guard_level:
+            return _descend(seq, _current_indent_level, append, markers)
         if markers is not None:
             marker_id = id(seq)
             if marker_id in markers:
                 raise ValueError('circular reference detected for sequence')
             markers[marker_id] = seq
-        buf = OPEN_SB
+        append(open_sb)
+        _current_indent_level += 1
         if _indent is not None:
-            _current_indent_level += 1
-            newline_indent = f'{NL}{_indent * _current_indent_level}'
-            separator = f'{_item_separator}{newline_indent}'
-            buf += newline_indent
+            newline_indent = nl + _indent * _current_indent_level
+            separator = _item_separator + newline_indent
+            append(newline_indent)
         else:
             newline_indent = None
             separator = _item_separator
-        is_first = True
-        for value in seq:
-            if is_first:
-                is_first = False
-            else:
-                buf = separator
-            if isinstance(value, str):
-                yield buf + _encoder(value)
-            elif any(value is atom for atom in (False, None, True)):
-                yield buf + JSON_FNT_MAP[value]
-            elif isinstance(value, (float, int)):
-                # Subclasses of float and int may override __str__, but should still serialize as numbers in JSON.
-                # One example within the standard library is IntEnum.
-                yield buf + py2es6.serialize(value)
-            else:
-                yield buf
-                chunker = (
-                    _iterencode_list
-                    if isinstance(value, (list, tuple))
-                    else (_iterencode_dict if isinstance(value, dict) else _iterencode)
-                )
-                yield from chunker(value, _current_indent_level)
+        join = None if _bulk is None else _bulk(seq)
+        if join is not None:
+            # sliced, so only the representations of one slice exist besides the output (slices of buffers are views
+            # or compact copies)
+            for start in range(0, len(seq), BULK_JOIN_ITEMS):
+                if start:
+                    append(separator)
+                append(join(seq[start : start + BULK_JOIN_ITEMS], separator))
+        else:
+            is_first = True
+            for value in seq:
+                if is_first:
+                    is_first = False
+                else:
+                    append(separator)
+                handler = scalar_handler(type(value))
+                if handler is not None:
+                    append(handler(value))
+                else:
+                    container_handler(type(value), _encode)(value, _current_indent_level, append, markers)
         if newline_indent is not None:
-            _current_indent_level -= 1
-            yield f'{NL}{_indent * _current_indent_level}'
-        yield CLOSE_SB
+            append(nl + _indent * (_current_indent_level - 1))
+        append(close_sb)
         if markers is not None:
-            try:
-                marker_id  # noqa
-            except NameError:
-                pass
-            else:
-                del markers[marker_id]
+            del markers[marker_id]
 
     @no_type_check
-    def _iterencode_dict(assoc, _current_indent_level):
+    def _encode_dict(assoc, _current_indent_level: int, append, markers):
         if not assoc:
-            yield EMPTY_OBJECT_REP
+            append(empty_object_rep)
             return
+        if _current_indent_level >= guard_level:
+            return _descend(assoc, _current_indent_level, append, markers)
         if markers is not None:
             marker_id = id(assoc)
             if marker_id in markers:
                 raise ValueError('circular reference detected for dict')
             markers[marker_id] = assoc
-        yield OPEN_CB
+        _current_indent_level += 1
         if _indent is not None:
-            _current_indent_level += 1
-            newline_indent = f'{NL}{_indent * _current_indent_level}'
-            item_separator = f'{_item_separator}{newline_indent}'
-            yield newline_indent
+            newline_indent = nl + _indent * _current_indent_level
+            lead, item_separator = open_cb + newline_indent, _item_separator + newline_indent
         else:
             newline_indent = None
-            item_separator = _item_separator
-        is_first = True
-        items = sorted(assoc.items(), key=lambda kv: kv[0].encode(ENCODING_FOR_SORT)) if _sort_keys else assoc.items()
-        for key, value in items:
-            if isinstance(key, str):
-                pass
-            # JavaScript is weakly typed for these, so it makes sense to also allow them.
-            # Many encoders seem to do something like this.
-            elif isinstance(key, (float, int)):
-                # see comment for float/int in _make_iterencode
-                key = py2es6.serialize(key)
-            elif any(value is atom for atom in (False, None, True)):
-                key = JSON_FNT_MAP[value]
-            elif _skip_keys:
-                continue
-            else:
-                raise TypeError(f'key {repr(key)} is not a string')
-            if is_first:
-                is_first = False
-            else:
-                yield item_separator
-
-            yield _encoder(key)
-            yield _key_separator
-
-            if isinstance(value, str):
-                yield _encoder(value)
-            elif any(value is atom for atom in (False, None, True)):
-                yield JSON_FNT_MAP[value]
-            elif isinstance(value, (float, int)):
-                # see comment for int/float in _make_iterencode
-                yield py2es6.serialize(value)
-            else:
-                chunker = (
-                    _iterencode_list
-                    if isinstance(value, (list, tuple))
-                    else (_iterencode_dict if isinstance(value, dict) else _iterencode)
-                )
-                yield from chunker(value, _current_indent_level)
-        if newline_indent is not None:
-            _current_indent_level -= 1
-            yield f'{NL}{_indent * _current_indent_level}'
-        yield CLOSE_CB
+            lead, item_separator = open_cb, _item_separator
+        keys, prefixes = _shape(assoc, _key_encoder, _key_separator, _sort_keys, _skip_keys, lead, item_separator)
+        if not keys:  # all keys skipped
+            append(empty_object_rep)
+        else:
+            for key, member_prefix in zip(keys, prefixes):
+                append(member_prefix)
+                value = assoc[key]
+                handler = scalar_handler(type(value))
+                if handler is not None:
+                    append(handler(value))
+                else:
+                    container_handler(type(value), _encode)(value, _current_indent_level, append, markers)
+            if newline_indent is not None:
+                append(nl + _indent * (_current_indent_level - 1))
+            append(close_cb)
         if markers is not None:
-            try:
-                marker_id  # noqa
-            except NameError:
-                pass
-            else:
-                del markers[marker_id]
+            del markers[marker_id]
 
     @no_type_check
-    def _iterencode(obj, _current_indent_level):
+    def _encode(obj, _current_indent_level: int, append, markers):
+        # The subclass-aware fallback for values whose exact type is not in the dispatch tables
         if isinstance(obj, str):
-            yield _encoder(obj)
-        elif any(obj is atom for atom in (False, None, True)):
-            yield JSON_FNT_MAP[obj]
+            append(_encoder(obj))
+        elif obj is None or obj is True or obj is False:
+            append(fnt_map[obj])
         elif isinstance(obj, (float, int)):
-            # see comment for float/int in _make_iterencode
-            yield py2es6.serialize(obj)
+            # see comment for float/int in make_walk
+            append(_serialize(obj))
         elif isinstance(obj, (list, tuple)):
-            yield from _iterencode_list(obj, _current_indent_level)
+            _encode_list(obj, _current_indent_level, append, markers)
         elif isinstance(obj, dict):
-            yield from _iterencode_dict(obj, _current_indent_level)
+            _encode_dict(obj, _current_indent_level, append, markers)
+        elif type(obj) in BUFFER_TYPES and buffer_item_type(obj) is not None:
+            _encode_list(obj, _current_indent_level, append, markers)
         else:
-            if markers is not None:
-                marker_id = id(obj)
-                if marker_id in markers:
-                    raise ValueError('circular reference detected')
-                markers[marker_id] = obj
-            obj = _default(obj)
-            yield from _iterencode(obj, _current_indent_level)
-            if markers is not None:
-                try:
-                    marker_id  # noqa
-                except NameError:
-                    pass
-                else:
-                    del markers[marker_id]
+            # the hook is called until it returns an encodable value (in a loop like in make_walk, so the number
+            # of calls in a row is bounded by the depth limit also without markers)
+            default_ids = []
+            hops = 0
+            while True:
+                if markers is not None:
+                    marker_id = id(obj)
+                    if marker_id in markers:
+                        raise ValueError('circular reference detected')
+                    markers[marker_id] = obj
+                    default_ids.append(marker_id)
+                hops += 1
+                if hops > depth_limit:
+                    raise ValueError(f'maximum depth of {depth_limit} exceeded in default hook calls')
+                obj = _default(obj)
+                if isinstance(obj, ENCODABLE_TYPES) or obj is None:
+                    break
+                if type(obj) in BUFFER_TYPES and buffer_item_type(obj) is not None:
+                    break
+            _encode(obj, _current_indent_level, append, markers)
+            for marker_id in default_ids:
+                del markers[marker_id]
 
-    return _iterencode
+    if _stats is not None:
+        # all paths (root, members, and the subclass fallback) reach the containers by these names
+        _encode_list = count_calls(_encode_list, _stats, STATS_CONTAINERS)
+        _encode_dict = count_calls(_encode_dict, _stats, STATS_CONTAINERS)
+    _encode_tuple = _encode_list
+    if _memo is not None:
+        _encode_list = memoize_container(_encode_list, _memo, _indent is not None, empty)
+        _encode_dict = memoize_container(_encode_dict, _memo, _indent is not None, empty)
+        _encode_tuple = _encode_list if _memo[2] is None else cache_tuple_content(_encode_list, _memo[2])
+    scalar_handler = scalar_handlers(_encoder, _serialize, fnt_map).get
+    container_handler = {list: _encode_list, tuple: _encode_tuple, dict: _encode_dict}.get
+
+    @no_type_check
+    def _one_shot(obj, append):
+        _encode(obj, 0, append, {} if _check_circular else None)
+
+    return _one_shot
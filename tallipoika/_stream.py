@@ -0,0 +1,317 @@
+"""Incremental tokenizer transforming JSON text into the canonical form without building the Python objects."""
+
+import codecs
+import re
+from json.decoder import JSONDecoder, scanstring  # type: ignore[attr-defined]
+from typing import no_type_check
+
+import tallipoika.py2es6 as py2es6
+from tallipoika._factory import (
+    CLOSE_CB_UTF8,
+    CLOSE_SB_UTF8,
+    ENCODING_FOR_SORT,
+    JSON_FNT_MAP,
+    OPEN_CB_UTF8,
+    OPEN_SB_UTF8,
+)
+from tallipoika.speedup import encode_basestring
+
+COMMA_UTF8 = b','
+COLON_UTF8 = b':'
+QUOTE = '"'
+BACKSLASH = '\\'
+NUMBER_START = frozenset('-0123456789')
+CONTAINER_START = frozenset('{[')
+NUMBER = re.compile(r'(-?(?:0|[1-9]\d*))(\.\d+)?([eE][-+]?\d+)?')
+WHITESPACE_CHARS = ' \t\n\r'
+WHITESPACE = re.compile(f'[{WHITESPACE_CHARS}]*')
+LITERALS = {rep: rep.encode() for rep in JSON_FNT_MAP.values()}
+LITERAL_MAX_LENGTH = max(len(rep) for rep in LITERALS)
+# Integer lexemes of up to 15 digits are exact as double, so (but for minus zero) they are their own ES6 form
+SAFE_DIGITS = 15
+MINUS_ZERO = '-0'
+# A lexeme may only be extended by a fraction or an exponent, and both are complete after three more characters
+NUMBER_LOOKAHEAD = 3
+
+# Parser states (what the next token may be)
+VALUE = 0  # any value
+FIRST_ELEMENT = 1  # any value or the end of the (empty) array
+NEXT_ELEMENT = 2  # comma or end of array
+FIRST_NAME = 3  # member name or the end of the (empty) object
+NAME = 4  # member name
+COLON = 5  # name separator
+NEXT_MEMBER = 6  # comma or end of object
+END = 7  # nothing but whitespace
+
+ARRAY = 0
+OBJECT = 1
+# Containers up to this nesting level are tried as a whole per the C decoder if they are complete in the window
+WHOLE_MAX_LEVEL = 1
+
+
+@no_type_check
+def _reject_constant(name):
+    raise ValueError(f'invalid constant {name}')
+
+
+DECODER = JSONDecoder(parse_constant=_reject_constant)
+
+
+@no_type_check
+def number_rep(integer, fraction, exponent):
+    """Return the ES6 form of the number lexeme given per its parts as json.loads and py2es6.serialize would."""
+    if fraction is None and exponent is None:
+        if len(integer) <= SAFE_DIGITS:
+            return '0' if integer == MINUS_ZERO else integer
+        return py2es6.serialize(int(integer))
+    return py2es6.serialize(float(integer + (fraction or '') + (exponent or '')))
+
+
+@no_type_check
+class _Lexer:
+    """Window on the text read chunk by chunk from the stream that only holds the text not consumed yet."""
+
+    __slots__ = ('read', 'decode', 'chunk_size', 'text', 'pos', 'offset', 'eof')
+
+    @no_type_check
+    def __init__(self, stream, chunk_size):
+        self.read = stream.read
+        self.decode = None
+        self.chunk_size = chunk_size
+        self.text = ''
+        self.pos = 0  # position of the next character in text
+        self.offset = 0  # characters consumed before text (for error messages)
+        self.eof = False
+
+    @no_type_check
+    def fill(self):
+        """Append the next chunk of the stream dropping the consumed text and return False at the end of the stream.
+
+        Chunks are at least as long as the text not consumed yet, so the window grows geometrically for long tokens
+        and the copies of the window per refill add up to linear time in the length of the token.
+        """
+        while not self.eof:
+            data = self.read(max(self.chunk_size, len(self.text) - self.pos))
+            if not data:
+                if self.decode is not None:
+                    self.decode(b'', True)  # raises for a truncated UTF-8 sequence at the end
+                self.eof = True
+                break
+            if not isinstance(data, str):
+                if self.decode is None:
+                    self.decode = codecs.getincrementaldecoder('utf-8')().decode
+                data = self.decode(data)
+                if not data:
+                    continue  # only part of a multibyte sequence so far
+            self.offset += self.pos
+            self.text = self.text[self.pos :] + data
+            self.pos = 0
+            return True
+        return False
+
+    @no_type_check
+    def error(self, message):
+        """Return the ValueError stating the message and the current character offset."""
+        return ValueError(f'{message} at character offset {self.offset + self.pos}')
+
+    @no_type_check
+    def peek(self):
+        """Skip whitespace and return the next character or the empty string at the end of the stream."""
+        if self.pos < len(self.text) and self.text[self.pos] not in WHITESPACE_CHARS:
+            return self.text[self.pos]
+        while True:
+            self.pos = WHITESPACE.match(self.text, self.pos).end()
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self.fill():
+                return ''
+
+    @no_type_check
+    def string(self):
+        """Consume the string starting at the current quote and return its value."""
+        search = 1  # relative to pos, which fill may move
+        while True:
+            end = self.text.find(QUOTE, self.pos + search)
+            if end < 0:
+                search = len(self.text) - self.pos
+                if not self.fill():
+                    raise self.error('unterminated string')
+                continue
+            escapes = end
+            while self.text[escapes - 1] == BACKSLASH:
+                escapes -= 1
+            if (end - escapes) % 2 == 0:
+                break
+            search = end + 1 - self.pos
+        try:
+            value, self.pos = scanstring(self.text, self.pos + 1, True)
+        except ValueError as error:
+            message = getattr(error, 'msg', 'invalid string').removesuffix(' at')
+            raise self.error(message[:1].lower() + message[1:]) from None
+        return value
+
+    @no_type_check
+    def number(self):
+        """Consume the number starting at the current position and return its ES6 form."""
+        while True:
+            match = NUMBER.match(self.text, self.pos)
+            if match is None:
+                if len(self.text) - self.pos < 2 and self.fill():
+                    continue
+                raise self.error('invalid number')
+            if len(self.text) - match.end() < NUMBER_LOOKAHEAD and self.fill():
+                continue  # the lexeme may continue in the next chunk
+            self.pos = match.end()
+            return number_rep(*match.groups())
+
+    @no_type_check
+    def whole(self, encode):
+        """Consume the container starting at the current position if it is complete and return its encoding else None.
+
+        The attempt fails fast for containers extending beyond the window (and for invalid text, which the
+        tokenizer then reports), so at most one attempt per window and level is wasted.
+        """
+        try:
+            value, end = DECODER.raw_decode(self.text, self.pos)
+        except ValueError:
+            return None
+        self.pos = end
+        return encode(value)
+
+    @no_type_check
+    def literal(self):
+        """Consume the literal true, false, or null and return its UTF-8 representation."""
+        while len(self.text) - self.pos < LITERAL_MAX_LENGTH and self.fill():
+            pass
+        for rep, rep_utf8 in LITERALS.items():
+            if self.text.startswith(rep, self.pos):
+                self.pos += len(rep)
+                return rep_utf8
+        raise self.error('expecting value')
+
+
+@no_type_check
+def _join_members(members):
+    """Return the canonical UTF-8 representation of the object from the dict of names to value representations."""
+    names = sorted(members, key=lambda name: name.encode(ENCODING_FOR_SORT))
+    parts = [encode_basestring(name).encode() + COLON_UTF8 + members[name] for name in names]
+    return OPEN_CB_UTF8 + COMMA_UTF8.join(parts) + CLOSE_CB_UTF8
+
+
+@no_type_check
+def iter_text(stream, chunk_size, sort_keys=True, encode=None):
+    """Yield the canonical (or with sort_keys false the serialized) UTF-8 form of the JSON text read from stream.
+
+    The stream provides the text (str or UTF-8 bytes) per read(size).
+    Arrays and unsorted objects are emitted token by token while sorted objects are buffered as the dict of
+    their member names to the representations of their values until their end.
+    So a huge top level array is transformed element by element in about the memory of its largest element.
+    The output is yielded in chunks of at least chunk_size bytes (but the last).
+    Duplicate names keep the last value (as json.loads) in sorted objects and invalid JSON text raises ValueError.
+
+    If encode is given, containers at the top two levels that are complete within the read window are decoded per
+    the C decoder and encoded as a whole per encode (which must produce the same representation).
+    """
+    lexer = _Lexer(stream, chunk_size)
+    main = out = bytearray()
+    stack = []  # frames: [ARRAY] or [OBJECT, members, name, out of parent] - unsorted objects keep members None
+    state = VALUE
+    while True:
+        char = lexer.peek()
+        if state <= FIRST_ELEMENT:
+            fragment = None
+            if encode is not None and len(stack) <= WHOLE_MAX_LEVEL and char in CONTAINER_START:
+                fragment = lexer.whole(encode)
+            if fragment is not None:
+                out += fragment
+            elif char == ']' and state == FIRST_ELEMENT:
+                lexer.pos += 1
+                stack.pop()
+                out += CLOSE_SB_UTF8
+            elif char == '{':
+                lexer.pos += 1
+                stack.append([OBJECT, {} if sort_keys else None, None, out])
+                if not sort_keys:
+                    out += OPEN_CB_UTF8
+                state = FIRST_NAME
+                continue
+            elif char == '[':
+                lexer.pos += 1
+                stack.append([ARRAY])
+                out += OPEN_SB_UTF8
+                state = FIRST_ELEMENT
+                continue
+            elif char == QUOTE:
+                out += encode_basestring(lexer.string()).encode()
+            elif char in NUMBER_START:
+                out += lexer.number().encode()
+            elif char:
+                out += lexer.literal()
+            else:
+                raise lexer.error('expecting value')
+        elif state == NEXT_ELEMENT:
+            lexer.pos += 1
+            if char == ',':
+                out += COMMA_UTF8
+                state = VALUE
+                continue
+            if char != ']':
+                lexer.pos -= 1
+                raise lexer.error("expecting ',' or ']'")
+            stack.pop()
+            out += CLOSE_SB_UTF8
+        elif state <= NAME:
+            if char == '}' and state == FIRST_NAME:
+                lexer.pos += 1
+                _, members, _, out = stack.pop()
+                out += CLOSE_CB_UTF8 if members is None else _join_members(members)
+            elif char == QUOTE:
+                stack[-1][2] = lexer.string()
+                state = COLON
+                continue
+            else:
+                raise lexer.error('expecting property name enclosed in double quotes')
+        elif state == COLON:
+            if char != ':':
+                raise lexer.error("expecting ':' delimiter")
+            lexer.pos += 1
+            frame = stack[-1]
+            if frame[1] is None:
+                out += encode_basestring(frame[2]).encode() + COLON_UTF8
+            else:
+                out = bytearray()  # the representation of the member value
+            state = VALUE
+            continue
+        elif state == NEXT_MEMBER:
+            lexer.pos += 1
+            if char == ',':
+                if stack[-1][1] is None:
+                    out += COMMA_UTF8
+                state = NAME
+                continue
+            if char != '}':
+                lexer.pos -= 1
+                raise lexer.error("expecting ',' or '}'")
+            _, members, _, out = stack.pop()
+            out += CLOSE_CB_UTF8 if members is None else _join_members(members)
+        else:
+            if char:
+                raise lexer.error('extra data')
+            if main:
+                yield bytes(main)
+            return
+
+        # A value is complete, so what may follow depends on the enclosing container
+        if not stack:
+            state = END
+        elif stack[-1][0] == ARRAY:
+            state = NEXT_ELEMENT
+        else:
+            frame = stack[-1]
+            if frame[1] is not None:
+                frame[1][frame[2]] = out
+                out = frame[3]
+            state = NEXT_MEMBER
+        if out is main and len(main) >= chunk_size:
+            yield bytes(main)
+            main.clear()
@@ -0,0 +1,70 @@
+"""JSON Canonicalization Scheme (JCS) serializer API for asyncio applications."""
+
+import asyncio
+from typing import AsyncIterator, no_type_check
+
+import tallipoika.api as api
+
+END = None  # the value of next when the chunks are exhausted
+
+
+@no_type_check
+async def encode_chunks(
+    obj, encoder, chunk_size: int = api.CHUNK_SIZE, offload=False, executor=None
+) -> AsyncIterator[bytes]:
+    """Yield the UTF-8 representation of obj per the encoder in chunks of at least chunk_size characters (but the last).
+
+    The chunks are produced per encoder.iterencode, and control is given back to the event loop after every chunk,
+    so other tasks wait at most for the encoding of about chunk_size characters.
+    If offload is true, the chunks are produced in the executor (None for the default executor of the loop)
+    while the loop stays free - use a thread pool, as the chunks stem from one generator.
+    """
+    chunks = api.coalesce(encoder.iterencode(obj), chunk_size)
+    if not offload:
+        for chunk in chunks:
+            yield chunk
+            await asyncio.sleep(0)
+        return
+
+    loop = asyncio.get_running_loop()
+    while (chunk := await loop.run_in_executor(executor, next, chunks, END)) is not END:
+        yield chunk
+
+
+@no_type_check
+def canonicalize_chunks(obj, chunk_size: int = api.CHUNK_SIZE, offload=False, executor=None) -> AsyncIterator[bytes]:
+    """Yield the canonical UTF-8 representation of obj in chunks without blocking the event loop."""
+    return encode_chunks(obj, api.CANONICAL_ENCODER, chunk_size, offload, executor)
+
+
+@no_type_check
+def serialize_chunks(obj, chunk_size: int = api.CHUNK_SIZE, offload=False, executor=None) -> AsyncIterator[bytes]:
+    """Yield the serialized UTF-8 representation of obj in chunks without blocking the event loop."""
+    return encode_chunks(obj, api.SERIALIZE_ENCODER, chunk_size, offload, executor)
+
+
+@no_type_check
+async def encode_to(writer, obj, encoder, chunk_size: int = api.CHUNK_SIZE, offload=False, executor=None) -> int:
+    """Write the UTF-8 representation of obj per the encoder chunk by chunk to the writer and return the bytes written.
+
+    The writer offers write(data) and the coroutine drain() like asyncio.StreamWriter, and every chunk written is
+    followed by a drain, so a slow reader throttles the encoding instead of the buffered output growing.
+    """
+    size = 0
+    async for chunk in encode_chunks(obj, encoder, chunk_size, offload, executor):
+        writer.write(chunk)
+        size += len(chunk)
+        await writer.drain()
+    return size
+
+
+@no_type_check
+async def canonicalize_to(writer, obj, chunk_size: int = api.CHUNK_SIZE, offload=False, executor=None) -> int:
+    """Write the canonical UTF-8 representation of obj to the writer and return the number of bytes written."""
+    return await encode_to(writer, obj, api.CANONICAL_ENCODER, chunk_size, offload, executor)
+
+
+@no_type_check
+async def serialize_to(writer, obj, chunk_size: int = api.CHUNK_SIZE, offload=False, executor=None) -> int:
+    """Write the serialized UTF-8 representation of obj to the writer and return the number of bytes written."""
+    return await encode_to(writer, obj, api.SERIALIZE_ENCODER, chunk_size, offload, executor)
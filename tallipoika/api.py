@@ -1,19 +1,63 @@
 """JSON Canonicalization Scheme (JCS) serializer API."""
 
-import math
-from typing import Any, no_type_check
+import concurrent.futures
+import functools
+import hashlib
+import io
+import itertools
+import os
+from typing import Iterable, Iterator, no_type_check
 
-from tallipoika._factory import make_iterencode as _make_iterencode
-from tallipoika.speedup import accelerated_make_encoder, encode_basestring, encode_basestring_ascii
+from tallipoika import ENCODING
+from tallipoika._factory import (
+    CLOSE_CB,
+    CLOSE_SB,
+    OPEN_CB,
+    OPEN_SB,
+    STATS_BYTES_EMITTED,
+    dict_shape,
+    make_encode as _make_encode,
+    make_fragment_cache,
+    make_iterencode as _make_iterencode,
+    memoizing,
+    new_stats,
+    shape_cache_clear as _shape_cache_clear,
+    shape_cache_info as _shape_cache_info,
+)
+from tallipoika._stream import iter_text as _iter_text
+from tallipoika.speedup import encode_basestring, encode_basestring_ascii
 
+CHUNK_SIZE = 1 << 16
+DIGEST_ALGORITHM = 'sha256'
+MAX_DEPTH = 1000
+# Top level containers with fewer items are encoded sequentially (starting a process pool costs more)
+PARALLEL_MIN_ITEMS = 10_000
+SLICES_PER_JOB = 4
 COLON = ':'
 COMMA = ','
 SPACE = ' '
+SURROGATE_PASS = 'surrogatepass'
 
-INFINITY = float('inf')
-REPR_NAN = 'NaN'
-REPR_POS_INF = 'Infinity'
-REPR_NEG_INF = '-Infinity'
+ENGINE_ITER = 'iter'
+ENGINE_STR = 'str'
+ENGINE_UTF8 = 'utf8'
+CONFIG_ATTRIBUTES = frozenset(
+    (
+        'check_circular',
+        'collect_stats',
+        'default',
+        'ensure_ascii',
+        'fragment_cache_size',
+        'indent',
+        'item_separator',
+        'key_separator',
+        'max_depth',
+        'memoize',
+        'skipkeys',
+        'sort_keys',
+        'trusted',
+    )
+)
 
 
 @no_type_check
@@ -30,8 +74,25 @@ class JSONEncoder:
     - Python `False` -> JSON false
     - Python `None` -> JSON null
 
+    Numeric buffers (`array.array` and one-dimensional `memoryview` of native integer or float formats) are encoded
+    as JSON arrays straight from the buffer.
+
     To extend recognition to other objects, subclass and implement a `default` method that returns a serializable
     object for `obj` if possible, otherwise it should call the superclass implementation (to raise `TypeError`).
+
+    Input that cannot contain circular references (e.g. fresh from `json.loads`) may be encoded in trusted mode
+    (`trusted=True`): instead of tracking every container in a markers dict, the encoder only counts the nesting
+    depth and raises `ValueError` beyond `max_depth`, which still stops any circular reference.
+
+    With `collect_stats=True` every encode call leaves the counts of the work done in the `stats` dict
+    (containers visited, keys sorted, numbers formatted, strings escaped, default calls, and bytes emitted)
+    together with the seconds spent sorting keys versus formatting numbers and strings.
+    Encoders that do not collect statistics run the uninstrumented engines and `stats` stays None.
+
+    Documents referencing the same sub-objects many times may be encoded with `memoize=True`: every container
+    occurring repeatedly within one encode call is encoded once and its fragment emitted for all other occurrences.
+    With `fragment_cache_size` greater zero (and no indent), the fragments of tuples holding only builtin scalars are
+    kept across calls in a least recently used cache of that size.
     """
 
     item_separator = f'{COMMA}{SPACE}'
@@ -49,6 +110,11 @@ class JSONEncoder:
         indent=None,
         separators=(COMMA, COLON),
         default=None,
+        trusted=False,
+        max_depth=MAX_DEPTH,
+        collect_stats=False,
+        memoize=False,
+        fragment_cache_size=0,
     ):
         """Constructor for JSONEncoder, with sensible defaults for JCS.
 
@@ -56,6 +122,18 @@ class JSONEncoder:
         for documentation cf. https://docs.python.org/3/library/json.html#json.JSONEncoder.
 
         The default value for the `sort_keys` parameter is `True`, so the output of dictionaries will be sorted by key.
+
+        The `allow_nan` parameter is kept for compatibility only and ignored: JCS has no representation for NaN and
+        the infinities, so encoding them always raises `ValueError`.
+
+        If `trusted` is true, `check_circular` is ignored and nesting deeper than `max_depth` raises `ValueError`.
+        Without circular reference checks nesting deeper than the recursion limit of the interpreter raises `ValueError`
+        unless `max_depth` is given in trusted mode.
+
+        If `collect_stats` is true, the statistics of the latest encode call are available per the `stats` attribute.
+        The statistics are kept per encoder, so share such encoders across threads only if approximate counts suffice.
+
+        If `memoize` is true (or `fragment_cache_size` is positive), repeated containers are encoded only once.
         """
         self.skipkeys = skipkeys
         self.ensure_ascii = ensure_ascii
@@ -69,6 +147,12 @@ class JSONEncoder:
             self.item_separator = COMMA
         if default is not None:
             self.default = default
+        self.trusted = trusted
+        self.max_depth = max_depth
+        self.collect_stats = collect_stats
+        self.memoize = memoize
+        self.fragment_cache_size = fragment_cache_size
+        self.stats = None
 
     @no_type_check
     def default(self, obj):
@@ -78,17 +162,41 @@ class JSONEncoder:
         """
         raise TypeError(f"Object of type '{obj.__class__.__name__}' is not JSON serializable")
 
+    @no_type_check
+    def __setattr__(self, name, value):
+        """Set the attribute and drop the built encode functions if the attribute is part of the configuration."""
+        if name in CONFIG_ATTRIBUTES:
+            self.__dict__['_engines'] = {}
+        object.__setattr__(self, name, value)
+
     @no_type_check
     def encode(self, obj):
         """Return a JSON string representation of a Python data structure."""
-        if isinstance(obj, str):  # This is for extremely simple cases and benchmarks.
+        if isinstance(obj, str) and not self.collect_stats:  # This is for extremely simple cases and benchmarks.
             return encode_basestring_ascii(obj) if self.ensure_ascii else encode_basestring(obj)
-        # This doesn't pass the iterator directly to ''.join() because the exceptions aren't as detailed.
-        # The list call should be roughly equivalent to the PySequence_Fast that ''.join() would do.
-        chunks = self.iterencode(obj, _one_shot=False)
-        if not isinstance(chunks, (list, tuple)):
-            chunks = list(chunks)
-        return ''.join(chunks)
+        # The one-shot engine appends all chunks to a single list, so ''.join() receives a ready sequence.
+        return ''.join(self.iterencode(obj, _one_shot=True))
+
+    @no_type_check
+    def encode_utf8(self, obj):
+        """Return the UTF-8 encoded JSON representation of a Python data structure.
+
+        All chunks are written as bytes to a single BytesIO buffer, so neither a list of chunks nor an intermediate
+        str of the document is built, and getvalue hands over the buffer without copying the document.
+        Callers that need a bytearray use encode_into.
+        """
+        buffer = io.BytesIO()
+        self.engine(ENGINE_UTF8)(obj, buffer.write)
+        return buffer.getvalue()
+
+    @no_type_check
+    def encode_into(self, obj, sink):
+        """Append the UTF-8 encoded JSON representation of a Python data structure to the bytearray sink.
+
+        Any growable sink with an extend method accepting bytes works, and the sink is returned for convenience.
+        """
+        self.engine(ENGINE_UTF8)(obj, sink.extend)
+        return sink
 
     @no_type_check
     def iterencode(self, obj, _one_shot=False):
@@ -99,30 +207,90 @@ class JSONEncoder:
             for chunk in JSONEncoder().iterencode(big_object):
                 mysocket.write(chunk)
 
+        If `_one_shot` is true, the complete list of string representations is returned instead of a generator.
         """
-        markers = {} if self.check_circular else None
-        _encoder = encode_basestring_ascii if self.ensure_ascii else encode_basestring
+        if _one_shot:
+            chunks = []
+            self.engine(ENGINE_STR)(obj, chunks.append)
+            return chunks
 
-        def floatstr(obj: Any, allow_nan=self.allow_nan, _repr=float.__repr__, _inf=INFINITY, _neginf=-INFINITY):
-            """Check for specials.
-
-            Note that this type of test is processor and platform-specific, so tests shall not rely on the internals.
-            """
-            if math.isfinite(obj):
-                return _repr(obj)  # noqa
-            elif not allow_nan:
-                raise ValueError(f'out of range float value {repr(obj)} is not JSON compliant')
-
-            if math.isnan(obj):
-                return REPR_NAN
-            if obj == _inf:
-                return REPR_POS_INF
-            if obj == _neginf:
-                return REPR_NEG_INF
-
-        if _one_shot and accelerated_make_encoder is not None and self.indent is None:
-            return accelerated_make_encoder(
-                markers,
+        return self.engine(ENGINE_ITER)(obj, 0)
+
+    @no_type_check
+    def engine(self, kind):
+        """Return the encode function of kind (ENGINE_ITER, ENGINE_STR, or ENGINE_UTF8) for the current configuration.
+
+        The function is built on first use and then reused until a configuration attribute changes.
+        The built functions keep no state between calls, so long-lived encoders can be shared by request handlers.
+        """
+        engines = self._engines
+        built = engines.get(kind)
+        if built is None:
+            built = engines[kind] = self._instrument(kind) if self.collect_stats else self._build(kind)
+        return built
+
+    @no_type_check
+    def _instrument(self, kind):
+        """Build the encode function of kind counting into fresh statistics that are published per call as stats."""
+        stats = new_stats()
+        built = self._build(kind, stats)
+        size = len if kind == ENGINE_UTF8 else _utf8_size
+
+        def _restart():
+            stats.update(new_stats())
+            self.stats = stats
+
+        if kind == ENGINE_ITER:
+
+            def _counted_chunks(chunks):
+                for chunk in chunks:
+                    stats[STATS_BYTES_EMITTED] += size(chunk)
+                    yield chunk
+
+            def _iterencode(obj, _current_indent_level):
+                _restart()
+                return _counted_chunks(built(obj, _current_indent_level))
+
+            return _iterencode
+
+        def _encode(obj, append):
+            _restart()
+
+            def _append(chunk):
+                stats[STATS_BYTES_EMITTED] += size(chunk)
+                append(chunk)
+
+            built(obj, _append)
+
+        return _encode
+
+    @no_type_check
+    def _build(self, kind, stats=None):
+        """Build the encode function of kind for the current configuration (counting into stats if not None)."""
+        make = self._maker(kind, stats)
+        if not self.memoize and self.fragment_cache_size <= 0:
+            return make()
+        fragment = None
+        if self.fragment_cache_size > 0 and self.indent is None:
+            utf8 = kind == ENGINE_UTF8
+            plain = self._maker(ENGINE_UTF8 if utf8 else ENGINE_STR, None)()
+            fragment = make_fragment_cache(plain, self.fragment_cache_size, b'' if utf8 else '')
+        # The identity memo shall live for one call only, so the memoizing engines are built per call
+        return memoizing(make, fragment)
+
+    @no_type_check
+    def _maker(self, kind, stats):
+        """Return the factory for the encode function of kind (taking the memo as _memo keyword argument)."""
+        _encoder = encode_basestring_ascii if self.ensure_ascii else encode_basestring
+        # In trusted mode the depth limit replaces the markers dict for circular reference checks
+        check_circular = self.check_circular and not self.trusted
+        max_depth = self.max_depth if self.trusted else None
+        if kind != ENGINE_ITER:
+            # The C accelerated make_encoder of the standard library formats floats per float.__repr__ which is
+            # not JCS compliant, so the one-shot path uses the pure Python engine with ES6 number formatting.
+            return functools.partial(
+                _make_encode,
+                check_circular,
                 self.default,
                 _encoder,
                 self.indent,
@@ -130,21 +298,51 @@ class JSONEncoder:
                 self.item_separator,
                 self.sort_keys,
                 self.skipkeys,
-                self.allow_nan,
-            )(obj, 0)
+                kind == ENGINE_UTF8,
+                max_depth,
+                stats,
+            )
 
-        return _make_iterencode(
-            markers,
+        return functools.partial(
+            _make_iterencode,
+            check_circular,
             self.default,
             _encoder,
             self.indent,
-            floatstr,
             self.key_separator,
             self.item_separator,
             self.sort_keys,
             self.skipkeys,
-            _one_shot,
-        )(obj, 0)
+            max_depth,
+            stats,
+        )
+
+
+@no_type_check
+def shape_cache_info():
+    """Return the hits, misses, maxsize, and currsize of the dict shape cache as named tuple."""
+    return _shape_cache_info()
+
+
+@no_type_check
+def shape_cache_clear():
+    """Clear the dict shape cache and reset its statistics."""
+    _shape_cache_clear()
+
+
+@no_type_check
+def _utf8_size(text):
+    """Return the number of bytes of the UTF-8 encoded text (lone surrogates count as three bytes each).
+
+    Strings may hold lone surrogates, which the str engines emit as is, so counting must not raise for them.
+    """
+    return len(text.encode(ENCODING, SURROGATE_PASS))
+
+
+# Pre-built encoders shared by the module level functions - treat as read-only (changing the configuration
+# attributes would change the results of canonicalize and serialize for all users in the process).
+CANONICAL_ENCODER = JSONEncoder(sort_keys=True)
+SERIALIZE_ENCODER = JSONEncoder(sort_keys=False)
 
 
 @no_type_check
@@ -153,10 +351,155 @@ def ensure_encoding(text: str, utf8: bool) -> str:
 
 
 @no_type_check
-def canonicalize(obj, utf8=True):
-    return ensure_encoding(JSONEncoder(sort_keys=True).encode(obj), utf8=utf8)
+def canonicalize(obj, utf8=True, jobs=1):
+    if jobs != 1:
+        encoded = encode_parallel(obj, True, jobs)
+        return encoded if utf8 else encoded.decode()
+    return CANONICAL_ENCODER.encode_utf8(obj) if utf8 else CANONICAL_ENCODER.encode(obj)
+
+
+@no_type_check
+def serialize(obj, utf8=True, jobs=1):
+    if jobs != 1:
+        encoded = encode_parallel(obj, False, jobs)
+        return encoded if utf8 else encoded.decode()
+    return SERIALIZE_ENCODER.encode_utf8(obj) if utf8 else SERIALIZE_ENCODER.encode(obj)
+
+
+@no_type_check
+def _encode_members(sort_keys, members):
+    """Return the UTF-8 representation of the (prefix, value) members of a top level slice (runs in the workers)."""
+    encode = (CANONICAL_ENCODER if sort_keys else SERIALIZE_ENCODER).engine(ENGINE_UTF8)
+    buffer = io.BytesIO()
+    for prefix, value in members:
+        buffer.write(prefix)
+        encode(value, buffer.write)
+    return buffer.getvalue()
+
+
+@no_type_check
+def encode_parallel(obj, sort_keys=True, jobs=0, executor=None):
+    """Return the canonical (or with sort_keys false the serialized) UTF-8 representation of obj using processes.
+
+    The members of a top level object (sorted first) or the elements of a top level array are split into
+    SLICES_PER_JOB slices per job, the slices are encoded in a process pool of jobs workers (0 for one per CPU) or
+    the given executor, and the fragments are concatenated in order, so the result equals the sequential one.
+    The values of the slices are pickled to the workers, so this pays off for large documents on many cores only:
+    top level containers with fewer than PARALLEL_MIN_ITEMS items and all other values are encoded sequentially.
+    """
+    encoder = CANONICAL_ENCODER if sort_keys else SERIALIZE_ENCODER
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or not isinstance(obj, (dict, list, tuple)) or len(obj) < PARALLEL_MIN_ITEMS:
+        return encoder.encode_utf8(obj)
+
+    if isinstance(obj, dict):
+        keys, prefixes = dict_shape(obj, encode_basestring, COLON, sort_keys, False, OPEN_CB, COMMA)
+        values, close = map(obj.__getitem__, keys), CLOSE_CB
+    else:
+        prefixes, values, close = [OPEN_SB, *itertools.repeat(COMMA, len(obj) - 1)], obj, CLOSE_SB
+    members = list(zip(map(str.encode, prefixes), values))
+    step = -(-len(members) // (jobs * SLICES_PER_JOB))
+    slices = [members[start : start + step] for start in range(0, len(members), step)]
+    encode_slice = functools.partial(_encode_members, sort_keys)
+    if executor is not None:
+        return b''.join(executor.map(encode_slice, slices)) + close.encode()
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as pool:
+        return b''.join(pool.map(encode_slice, slices)) + close.encode()
+
+
+@no_type_check
+def _encode_many(encoder, iterable, utf8):
+    """Yield the representations of the items of iterable using the one encode function built by encoder."""
+    encode = encoder.engine(ENGINE_UTF8 if utf8 else ENGINE_STR)
+    if utf8:
+        for obj in iterable:
+            buffer = io.BytesIO()
+            encode(obj, buffer.write)
+            yield buffer.getvalue()
+    else:
+        for obj in iterable:
+            chunks = []
+            encode(obj, chunks.append)
+            yield ''.join(chunks)
+
+
+@no_type_check
+def canonicalize_many(iterable, utf8=True):
+    """Yield the canonical representation of every item of iterable building the encoding machinery only once."""
+    return _encode_many(CANONICAL_ENCODER, iterable, utf8)
+
+
+@no_type_check
+def serialize_many(iterable, utf8=True):
+    """Yield the serialized representation of every item of iterable building the encoding machinery only once."""
+    return _encode_many(SERIALIZE_ENCODER, iterable, utf8)
+
+
+@no_type_check
+def canonicalize_into(obj, sink):
+    """Append the canonical UTF-8 representation of obj to the growable sink (e.g. a bytearray) and return the sink."""
+    return CANONICAL_ENCODER.encode_into(obj, sink)
+
+
+@no_type_check
+def coalesce(chunks: Iterable[str], chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield the UTF-8 encoded concatenated of the chunks in pieces of at least chunk_size characters (but the last)."""
+    parts, size = [], 0
+    for chunk in chunks:
+        parts.append(chunk)
+        size += len(chunk)
+        if size >= chunk_size:
+            yield ''.join(parts).encode()
+            parts, size = [], 0
+    if parts:
+        yield ''.join(parts).encode()
+
+
+@no_type_check
+def canonicalize_chunks(obj, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield the canonical UTF-8 representation of obj in coalesced chunks without materializing the document."""
+    return coalesce(CANONICAL_ENCODER.iterencode(obj), chunk_size)
+
+
+@no_type_check
+def serialize_chunks(obj, chunk_size: int = CHUNK_SIZE) -> Iterator[bytes]:
+    """Yield the serialized UTF-8 representation of obj in coalesced chunks without materializing the document."""
+    return coalesce(SERIALIZE_ENCODER.iterencode(obj), chunk_size)
+
+
+@no_type_check
+def canonicalize_text(stream, chunk_size: int = CHUNK_SIZE, sort_keys: bool = True) -> Iterator[bytes]:
+    """Yield the canonical UTF-8 representation of the JSON text read from stream without loading the document.
+
+    The text is tokenized incrementally and number lexemes map directly to their ES6 form, so only the members of
+    the objects currently being sorted are held in memory - a huge top level array streams element by element.
+    The stream may provide str or UTF-8 bytes per read(size) and with sort_keys false the keys keep their order.
+    The results equal canonicalize(json.loads(text)) and invalid JSON text raises ValueError.
+    """
+    return _iter_text(stream, chunk_size, sort_keys, CANONICAL_ENCODER.encode_utf8 if sort_keys else None)
+
+
+@no_type_check
+def canonical_hasher(obj, hasher, chunk_size: int = CHUNK_SIZE):
+    """Feed the canonical UTF-8 representation of obj chunk by chunk into the hashlib compatible hasher and return it.
+
+    Only a single chunk of the output exists at any time, so the memory needed does not depend on the document size.
+    """
+    for chunk in canonicalize_chunks(obj, chunk_size):
+        hasher.update(chunk)
+    return hasher
+
+
+@no_type_check
+def canonical_digest(obj, algorithm: str = DIGEST_ALGORITHM, chunk_size: int = CHUNK_SIZE) -> str:
+    """Return the hex digest of the canonical UTF-8 representation of obj per the hashlib algorithm name."""
+    return canonical_hasher(obj, hashlib.new(algorithm), chunk_size).hexdigest()
 
 
 @no_type_check
-def serialize(obj, utf8=True):
-    return ensure_encoding(JSONEncoder(sort_keys=False).encode(obj), utf8=utf8)
+def is_fixed_length_digest(algorithm: str) -> bool:
+    """Return True if the hashlib algorithm name is available and yields digests of fixed length (not shake)."""
+    try:
+        return hashlib.new(algorithm).digest_size > 0
+    except ValueError:
+        return False
@@ -1,11 +1,20 @@
 """JSON Canonicalization Scheme (JCS) serializer  - command line interface."""
 
 import argparse
+import collections
+import concurrent.futures
+import contextlib
+import glob
+import hashlib
 import _io  # type: ignore
+import itertools
 import json
+import os
 import pathlib
+import shutil
 import sys
-from typing import Union, no_type_check
+import tempfile
+from typing import Callable, Iterator, Union, no_type_check
 
 import tallipoika.api as api
 from tallipoika import (
@@ -15,6 +24,27 @@ from tallipoika import (
     VERSION,
 )
 
+BATCH_SIZE = 256
+CACHE_NAME = f'.{APP_ALIAS}-cache.json'
+CHUNK_SIZE = 1 << 16
+DEFAULT_FILE_MODE = 0o666  # before applying the umask
+DIRECTORY_PATTERN = '*.json'
+FILES_PER_TASK = 16
+GLOB_MAGIC = frozenset('*?[')
+IN_FLIGHT_PER_JOB = 2
+LF = b'\n'
+RECORD_SEPARATOR = '\x1e'
+RS = RECORD_SEPARATOR.encode()
+TEMP_SUFFIX = '.tmp'
+
+# File states reported by transform_file (the first three mean the file is in transformed form afterwards)
+KNOWN = 'known'
+VALID = 'valid'
+REWRITTEN = 'rewritten'
+DIFFERS = 'differs'
+FAILED = 'failed'
+TRANSFORMED_STATES = (KNOWN, VALID, REWRITTEN)
+
 
 @no_type_check
 def parse_request(argv: list[str]) -> Union[int, argparse.Namespace]:
@@ -48,6 +78,98 @@ def parse_request(argv: list[str]) -> Union[int, argparse.Namespace]:
         action='store_true',
         help='serialize only i.e. do not sort keys (default: False)',
     )
+    records = parser.add_mutually_exclusive_group()
+    records.add_argument(
+        '--lines',
+        '-l',
+        dest='lines',
+        default=False,
+        action='store_true',
+        help='stream JSON Lines i.e. transform one JSON text per line (default: False)',
+    )
+    records.add_argument(
+        '--json-seq',
+        dest='json_seq',
+        default=False,
+        action='store_true',
+        help='stream RFC 7464 JSON text sequences i.e. records led by RS (default: False)',
+    )
+    parser.add_argument(
+        '--jobs',
+        '-j',
+        dest='jobs',
+        type=int,
+        default=1,
+        help='number of worker processes for record streams and batch sources - 0 for one per CPU (default: 1)',
+    )
+    parser.add_argument(
+        '--batch-size',
+        dest='batch_size',
+        type=int,
+        default=BATCH_SIZE,
+        help=f'number of records per worker task (default: {BATCH_SIZE})',
+    )
+    parser.add_argument(
+        '--chunk-size',
+        dest='chunk_size',
+        type=int,
+        default=api.CHUNK_SIZE,
+        help=f'minimal number of characters per write of a document (default: {api.CHUNK_SIZE})',
+    )
+    parser.add_argument(
+        '--stream',
+        dest='stream',
+        default=False,
+        action='store_true',
+        help='tokenize the document incrementally instead of loading it as a whole (default: False)',
+    )
+    parser.add_argument(
+        '--digest',
+        '-d',
+        dest='digest',
+        default=False,
+        action='store_true',
+        help='write the hex digest of the transformed document instead (default: False)',
+    )
+    parser.add_argument(
+        '--digest-algorithm',
+        dest='digest_algorithm',
+        default=api.DIGEST_ALGORITHM,
+        metavar='ALGORITHM',
+        help=f'hashlib algorithm of the digest (default: {api.DIGEST_ALGORITHM})',
+    )
+    parser.add_argument(
+        '--check',
+        '-c',
+        dest='check',
+        default=False,
+        action='store_true',
+        help='write nothing but fail at the first byte where the source differs from its canonical form\n'
+        '(default: False)',
+    )
+    parser.add_argument(
+        '--in-place',
+        dest='in_place',
+        default=False,
+        action='store_true',
+        help='replace the source files by their transforms (atomically) - required for directory and glob sources\n'
+        'unless in check mode (default: False)',
+    )
+    parser.add_argument(
+        '--cache',
+        dest='cache',
+        default=False,
+        action='store_true',
+        help='skip source files unchanged since they were found in transformed form per the cache file\n'
+        '(default: False)',
+    )
+    parser.add_argument(
+        '--cache-path',
+        dest='cache_path',
+        default=CACHE_NAME,
+        metavar='PATH',
+        help=f'path of the cache file (default: {CACHE_NAME})',
+    )
     parser.add_argument(
         '--version',
         '-V',
@@ -64,40 +186,363 @@ def parse_request(argv: list[str]) -> Union[int, argparse.Namespace]:
         print(f'{APP_NAME} version {VERSION}')
         return 0
 
+    if options.jobs < 0 or options.batch_size < 1 or options.chunk_size < 1:
+        parser.error('jobs must not be negative and batch size as well as chunk size must be positive')
+    if not api.is_fixed_length_digest(options.digest_algorithm):
+        parser.error(f'requested digest algorithm ({options.digest_algorithm}) is not available or has no fixed length')
+    options.digest = options.digest_algorithm if options.digest else ''  # the algorithm if a digest is requested
+    if options.check and options.digest:
+        parser.error('check mode (--check) compares the transform with the source and cannot write a digest')
+    if options.check and options.out_path is not sys.stdout:
+        parser.error('check mode (--check) writes nothing (no --out-path)')
+    if options.check:
+        options.serialize_only = True  # check mode always verifies the canonical form (selected per this flag)
+    if options.jobs == 0:
+        options.jobs = os.cpu_count() or 1
+
     if not options.in_path:
         if options.in_path_pos:
             options.in_path = options.in_path_pos
         else:
             options.in_path = sys.stdin
 
+    if options.check and options.in_path is sys.stdin:
+        parser.error('check mode (--check) requires a source file path')
+    if options.in_place and options.in_path is sys.stdin:
+        parser.error('in place mode (--in-place) requires a source path')
+    if options.in_place and options.check:
+        parser.error('in place mode (--in-place) and check mode (--check) exclude each other')
+
+    options.sources = []  # the files of batch sources (else empty)
     if options.in_path is not sys.stdin:
         in_path = pathlib.Path(options.in_path)
-        if in_path.exists():
-            if in_path.is_file():
-                return options
-            parser.error(f'requested source ({in_path}) is not a file')
-        parser.error(f'requested source ({in_path}) does not exist')
+        batch = options.in_place or options.check
+        if not in_path.exists() and GLOB_MAGIC.intersection(str(in_path)):
+            if not batch:
+                parser.error(f'requested source ({in_path}) is a glob and requires --in-place or --check')
+            matches = map(pathlib.Path, glob.glob(str(in_path), recursive=True))
+            options.sources = sorted(path for path in matches if path.is_file())
+            if not options.sources:
+                parser.error(f'requested source ({in_path}) matches no files')
+        elif in_path.is_dir() and batch:
+            options.sources = sorted(path for path in in_path.rglob(DIRECTORY_PATTERN) if path.is_file())
+            if not options.sources:
+                parser.error(f'requested source ({in_path}) holds no {DIRECTORY_PATTERN} files')
+        elif not in_path.exists():
+            parser.error(f'requested source ({in_path}) does not exist')
+        elif not in_path.is_file():
+            parser.error(f'requested source ({in_path}) is not a file (directories require --in-place or --check)')
+        elif options.in_place:
+            options.sources = [in_path]
+
+    if options.jobs != 1 and not (options.lines or options.json_seq or options.sources):
+        parser.error(
+            'parallel processing (--jobs) requires record streams (--lines or --json-seq)'
+            ' or batch sources (directory, glob, or --in-place)'
+        )
+    if options.sources and (options.lines or options.json_seq or options.out_path is not sys.stdout):
+        parser.error('batch sources (directory, glob, or --in-place) conflict with --lines, --json-seq, and -o')
+    if options.sources and options.digest:
+        parser.error('batch sources (directory, glob, or --in-place) cannot write a digest')
+    options.cache = options.cache_path if options.cache else ''  # the path if a cache is requested
+    if options.cache and not options.sources:
+        parser.error('the cache (--cache) requires batch sources (directory, glob, or --in-place)')
 
     return options
 
 
-def process(options: argparse.Namespace) -> int:
-    """Visit the source and yield the requested transformed target."""
-    if isinstance(options.in_path, _io.TextIOWrapper):
-        loaded = options.in_path.read()
+@no_type_check
+def chunked_transformer(serialize_only: bool) -> Callable[[object, int], Iterator[bytes]]:
+    """Select the chunked transform function as per the options."""
+    return api.canonicalize_chunks if serialize_only else api.serialize_chunks
+
+
+def hex_digest(chunks: Iterator[bytes], algorithm: str) -> bytes:
+    """Return the hex digest of the concatenated chunks as ASCII bytes."""
+    hasher = hashlib.new(algorithm)
+    for chunk in chunks:
+        hasher.update(chunk)
+    return hasher.hexdigest().encode()
+
+
+@contextlib.contextmanager
+def text_source(in_path: Union[str, _io.TextIOWrapper]) -> Iterator[_io.TextIOWrapper]:
+    """Provide the text stream of the source (STDIN or file path)."""
+    if isinstance(in_path, _io.TextIOWrapper):
+        yield in_path
     else:
-        in_path = pathlib.Path(options.in_path)
-        with open(in_path, 'r', encoding=ENCODING) as source:
-            loaded = source.read()
+        with open(pathlib.Path(in_path), 'r', encoding=ENCODING) as source:
+            yield source
 
-    transformed = api.canonicalize(json.loads(loaded)) if options.serialize_only else api.serialize(json.loads(loaded))
 
-    if isinstance(options.out_path, _io.TextIOWrapper):
-        options.out_path.write(transformed.decode())
+@contextlib.contextmanager
+def binary_target(out_path: Union[str, _io.TextIOWrapper]) -> Iterator[Callable[[bytes], int]]:
+    """Provide a binary write function for the target (STDOUT or file path)."""
+    if isinstance(out_path, _io.TextIOWrapper):
+        out_path.flush()
+        yield out_path.buffer.write
+        out_path.buffer.flush()
     else:
-        out_path = pathlib.Path(options.out_path)
-        with open(out_path, 'wb') as target:
-            target.write(transformed)
+        with open(pathlib.Path(out_path), 'wb') as target:
+            yield target.write
+
+
+class MismatchError(ValueError):
+    """The source differs from its transform starting at the byte offset."""
+
+    def __init__(self, offset: int):
+        super().__init__(f'source differs from its transform at byte offset {offset}')
+        self.offset = offset
+
+
+def first_difference(left: bytes, right: bytes) -> int:
+    """Return the index of the first differing byte (or the length of the shorter if one is a prefix)."""
+    return next((index for index, (a, b) in enumerate(zip(left, right)) if a != b), min(len(left), len(right)))
+
+
+@contextlib.contextmanager
+def check_target(in_path: str) -> Iterator[Callable[[bytes], int]]:
+    """Provide a write function comparing the chunks with the bytes of the source file instead of writing them.
+
+    The source is read only as far as the chunks reach, so the first differing chunk raises MismatchError
+    (stating the offset of the first differing byte) without reading the rest of the source.
+    Source bytes left after the last chunk raise MismatchError at their offset.
+    """
+    offset = 0
+    with open(pathlib.Path(in_path), 'rb') as source:
+
+        def compare(chunk: bytes) -> int:
+            nonlocal offset
+            expected = source.read(len(chunk))
+            if expected != chunk:
+                raise MismatchError(offset + first_difference(expected, chunk))
+            offset += len(chunk)
+            return len(chunk)
+
+        yield compare
+        if source.read(1):
+            raise MismatchError(offset)
+
+
+def output_target(options: argparse.Namespace) -> contextlib.AbstractContextManager[Callable[[bytes], int]]:
+    """Provide the write function of the target as per the options (comparing with the source in check mode)."""
+    return check_target(options.in_path) if options.check else binary_target(options.out_path)
+
+
+def line_records(source: _io.TextIOWrapper) -> Iterator[str]:
+    """Yield the JSON texts of a JSON Lines stream one by one."""
+    yield from source
+
+
+def sequence_records(source: _io.TextIOWrapper, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """Yield the JSON texts of a RFC 7464 JSON text sequence one by one reading chunk-wise."""
+    parts = []
+    while chunk := source.read(chunk_size):
+        head, *records = chunk.split(RECORD_SEPARATOR)
+        parts.append(head)
+        for record in records:
+            yield ''.join(parts)
+            parts = [record]
+    yield ''.join(parts)
+
+
+def transform_record(serialize_only: bool, digest: str, lead: bytes, record: str) -> bytes:
+    """Transform a single record into the output record (or the line with its hex digest if requested)."""
+    loaded = json.loads(record)
+    if digest:
+        return hex_digest(chunked_transformer(serialize_only)(loaded, CHUNK_SIZE), digest) + LF
+    transformed: bytes = (api.canonicalize if serialize_only else api.serialize)(loaded)
+    return lead + transformed + LF
+
+
+def transform_records(serialize_only: bool, digest: str, lead: bytes, records: list[str]) -> bytes:
+    """Transform a batch of records into the joined output records (runs in the worker processes)."""
+    return b''.join(transform_record(serialize_only, digest, lead, record) for record in records if record.strip())
+
+
+def batched(records: Iterator[str], batch_size: int) -> Iterator[list[str]]:
+    """Yield lists of up to batch_size records."""
+    while batch := list(itertools.islice(records, batch_size)):
+        yield batch
+
+
+def process_records(options: argparse.Namespace) -> int:
+    """Transform the source record by record so memory use stays flat independent of the source size."""
+    records, lead = (sequence_records, RS) if options.json_seq else (line_records, b'')
+    with text_source(options.in_path) as source, output_target(options) as write:
+        if options.jobs > 1:
+            return process_records_parallel(options, records(source), lead, write)
+        for record in records(source):
+            if record.strip():  # skip blank lines and empty sequence records
+                write(transform_record(options.serialize_only, options.digest, lead, record))
+
+    return 0
+
+
+def process_records_parallel(
+    options: argparse.Namespace, records: Iterator[str], lead: bytes, write: Callable[[bytes], int]
+) -> int:
+    """Transform batches of records in a process pool and write the results in source order.
+
+    The number of batches in flight is bounded, so memory use stays flat as in the sequential case.
+    """
+    in_flight = options.jobs * IN_FLIGHT_PER_JOB
+    with concurrent.futures.ProcessPoolExecutor(max_workers=options.jobs) as pool:
+        pending: collections.deque[concurrent.futures.Future[bytes]] = collections.deque()
+        for batch in batched(records, options.batch_size):
+            pending.append(pool.submit(transform_records, options.serialize_only, options.digest, lead, batch))
+            if len(pending) >= in_flight:
+                write(pending.popleft().result())
+        while pending:
+            write(pending.popleft().result())
+
+    return 0
+
+
+def new_file_mode() -> int:
+    """Return the mode of files created by open as per the umask of the process."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return DEFAULT_FILE_MODE & ~umask
+
+
+def atomic_write(path: pathlib.Path, data: bytes) -> None:
+    """Replace the file at path by data so readers see either the old or the new content but never a partial file.
+
+    The data is written to a temporary file in the same folder, synced, and renamed over the target.
+    """
+    fd, temp_name = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.', suffix=TEMP_SUFFIX)
+    try:
+        with os.fdopen(fd, 'wb') as temp:
+            temp.write(data)
+            temp.flush()
+            os.fsync(temp.fileno())
+        if path.exists():
+            shutil.copymode(path, temp_name)
+        else:
+            os.chmod(temp_name, new_file_mode())  # instead of the private mode of the temporary file
+        os.replace(temp_name, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(temp_name)
+        raise
+
+
+def transform_file(serialize_only: bool, in_place: bool, known: str, path: pathlib.Path) -> tuple[str, str, int, int]:
+    """Transform (or only check) the file and return its state, the digest or message, and its mtime and size.
+
+    Files with the known digest (of their transformed form) are neither parsed nor written (runs in the workers).
+    """
+    try:
+        stat = path.stat()
+        data = path.read_bytes()
+        digest = hashlib.new(api.DIGEST_ALGORITHM, data).hexdigest()
+        if digest == known:
+            return KNOWN, digest, stat.st_mtime_ns, stat.st_size
+        transformed = (api.canonicalize if serialize_only else api.serialize)(json.loads(data))
+        if transformed == data:
+            return VALID, digest, stat.st_mtime_ns, stat.st_size
+        if not in_place:
+            return DIFFERS, str(MismatchError(first_difference(data, transformed))), 0, 0
+        atomic_write(path, transformed)
+        stat = path.stat()
+    except (OSError, ValueError) as error:  # sources that are no JSON texts cannot be transformed
+        return FAILED, str(error), 0, 0
+    return REWRITTEN, hashlib.new(api.DIGEST_ALGORITHM, transformed).hexdigest(), stat.st_mtime_ns, stat.st_size
+
+
+def load_cache(cache_path: str) -> dict[str, dict[str, list[object]]]:
+    """Return the cache entries per transform (a cache that is missing or cannot be read starts empty)."""
+    try:
+        cache = json.loads(pathlib.Path(cache_path).read_text(encoding=ENCODING))
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def process_files(options: argparse.Namespace) -> int:
+    """Transform in place (or check) the batch of source files in a process pool and report the files failing.
+
+    Files with the same mtime and size as cached for their transformed form are skipped without reading them,
+    and files whose bytes still hash to the cached digest are skipped without parsing them.
+    """
+    cache = load_cache(options.cache) if options.cache else {}
+    entries = cache.setdefault('canonical' if options.serialize_only else 'serialized', {})
+    excluded = str(pathlib.Path(options.cache).resolve()) if options.cache else ''
+    keys: list[str] = []
+    paths: list[pathlib.Path] = []
+    knowns: list[str] = []
+    for path in options.sources:
+        key = str(path.resolve())
+        if key == excluded:  # the cache may live among the sources
+            continue
+        mtime_ns, size, known = entries.get(key, (0, 0, ''))
+        with contextlib.suppress(OSError):  # files gone meanwhile are reported as failing by transform_file
+            stat = path.stat()
+            if known and (stat.st_mtime_ns, stat.st_size) == (mtime_ns, size):
+                continue
+        keys.append(key)
+        paths.append(path)
+        knowns.append(str(known))  # the cache is read from a file, so whatever was no digest matches none
+
+    transform_args = (itertools.repeat(options.serialize_only), itertools.repeat(options.in_place), knowns, paths)
+    with contextlib.ExitStack() as stack:
+        if options.jobs > 1 and len(paths) > 1:
+            pool = stack.enter_context(concurrent.futures.ProcessPoolExecutor(max_workers=options.jobs))
+            chunk_size = max(1, min(FILES_PER_TASK, len(paths) // options.jobs))
+            results = pool.map(transform_file, *transform_args, chunksize=chunk_size)
+        else:
+            results = map(transform_file, *transform_args)
+        failures = 0
+        for key, path, (state, detail, mtime_ns, size) in zip(keys, paths, results):
+            if state in TRANSFORMED_STATES:
+                entries[key] = [mtime_ns, size, detail]
+            else:
+                entries.pop(key, None)
+                print(f'{path}: {detail}', file=sys.stderr)
+                failures += 1
+
+    if options.cache:
+        atomic_write(pathlib.Path(options.cache), json.dumps(cache, indent=1, sort_keys=True).encode() + LF)
+    return 1 if failures else 0
+
+
+def process(options: argparse.Namespace) -> int:
+    """Visit the source and yield the requested transformed target (or in check mode compare it with the source)."""
+    if options.sources:
+        return process_files(options)
+    if not options.check:
+        return transform(options)
+    try:
+        return transform(options)
+    except ValueError as error:  # sources that are no JSON texts differ from any transform
+        print(f'{options.in_path}: {error}', file=sys.stderr)
+        return 1
+
+
+def transform(options: argparse.Namespace) -> int:
+    """Transform the source into the target as per the options."""
+    if options.lines or options.json_seq:
+        return process_records(options)
+
+    with contextlib.ExitStack() as stack:
+        # In check mode the source is tokenized incrementally as well, so a difference stops the reading early
+        if options.stream or options.check:
+            # Only the members of the objects being sorted are held in memory - not even the loaded document
+            source = stack.enter_context(text_source(options.in_path))
+            chunks = api.canonicalize_text(source, options.chunk_size, sort_keys=options.serialize_only)
+        else:
+            with text_source(options.in_path) as source:
+                loaded = json.load(source)
+            # The chunks are written (or hashed) as they are produced, so the output never exists as a whole in memory
+            chunks = chunked_transformer(options.serialize_only)(loaded, options.chunk_size)
+
+        with output_target(options) as write:
+            if options.digest:
+                write(hex_digest(chunks, options.digest) + LF)
+            else:
+                for chunk in chunks:
+                    write(chunk)
 
     return 0
 
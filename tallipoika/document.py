@@ -0,0 +1,536 @@
+"""Canonical documents keeping per subtree fragments for incremental re-canonicalization after small edits."""
+
+import copy
+import bisect
+import functools
+import hashlib
+import itertools
+from typing import no_type_check
+
+import tallipoika.api as api
+import tallipoika.py2es6 as py2es6
+from tallipoika._factory import ENCODING_FOR_SORT, JSON_FNT_MAP_UTF8, NONE_TYPE, stringify_key
+from tallipoika.speedup import encode_basestring
+
+POINTER_SEP = '/'
+APPEND_INDEX = '-'
+OPEN_SB = b'['
+CLOSE_SB = b']'
+OPEN_CB = b'{'
+CLOSE_CB = b'}'
+COMMA = b','
+COLON = b':'
+PATCH_OPERATIONS = ('add', 'remove', 'replace', 'move', 'copy', 'test')
+MEMBER_CACHE_SIZE = 4096
+# Children per slice of the container fragments (edits only re-join the slices holding changed children)
+SLICE_SIZE = 256
+
+
+@no_type_check
+def parse_pointer(pointer):
+    """Return the reference tokens of the JSON Pointer (RFC 6901) as list of str (the empty list for the root)."""
+    if not pointer:
+        return []
+    if not pointer.startswith(POINTER_SEP):
+        raise ValueError(f'JSON pointer {pointer!r} does not start with {POINTER_SEP!r}')
+    return [token.replace('~1', POINTER_SEP).replace('~0', '~') for token in pointer[1:].split(POINTER_SEP)]
+
+
+@no_type_check
+def format_pointer(tokens):
+    """Return the JSON Pointer (RFC 6901) for the reference tokens."""
+    return ''.join(POINTER_SEP + str(token).replace('~', '~0').replace(POINTER_SEP, '~1') for token in tokens)
+
+
+@no_type_check
+class Node:
+    """A value of the document with the cached canonical UTF-8 fragment (None while stale).
+
+    Objects hold their members as dict of member name to node plus the member names in canonical order (None while
+    stale), arrays hold a list of nodes, and all other values are leaves holding the value and its fragment.
+    Containers also keep their members in slices: the number of children per slice (sizes), the joined fragment
+    per slice (chunks, None while all slices are stale), and the indices of the slices changed since the last join.
+    """
+
+    __slots__ = ('kind', 'value', 'children', 'order', 'fragment', 'sizes', 'chunks', 'dirty')
+
+    @no_type_check
+    def __init__(self, kind, value=None, children=None, fragment=None):
+        self.kind = kind
+        self.value = value
+        self.children = children
+        self.order = None
+        self.fragment = fragment
+        self.sizes = None
+        self.chunks = None
+        self.dirty = None
+
+
+OBJECT, ARRAY, LEAF = 'object', 'array', 'leaf'
+
+
+@functools.lru_cache(maxsize=MEMBER_CACHE_SIZE)
+@no_type_check
+def member_prefix(name):
+    """Return the canonical UTF-8 member name and colon for the member name."""
+    return encode_basestring(name).encode() + COLON
+
+
+@functools.lru_cache(maxsize=MEMBER_CACHE_SIZE)
+@no_type_check
+def canonical_order(names):
+    """Return the tuple of member names in canonical order (cached, as many objects share their member names)."""
+    return tuple(sorted(names, key=lambda name: name.encode(ENCODING_FOR_SORT)))
+
+
+@no_type_check
+def _canonical_leaves():
+    """Return the table mapping the exact builtin scalar types to functions returning their canonical UTF-8 bytes."""
+    _atom = JSON_FNT_MAP_UTF8.__getitem__
+
+    def _string(text):
+        return encode_basestring(text).encode()
+
+    def _number(number):
+        return py2es6.serialize(number).encode()
+
+    return {str: _string, int: _number, float: _number, bool: _atom, NONE_TYPE: _atom}
+
+
+CANONICAL_LEAVES = _canonical_leaves()
+
+
+@no_type_check
+def fold(obj, leaf, fold_object, fold_array):
+    """Return the result of folding the Python data structure obj bottom up with an explicit stack of frames.
+
+    Values that are neither dict, list, nor tuple are mapped per leaf(value). Containers are mapped per
+    fold_object(members) with the list of (member name, result) pairs and fold_array(elements) with the list of
+    (None, result) pairs once all their values are folded. No recursion is involved, so any nesting depth works.
+    """
+    results = []
+    stack = [(None, None, iter(((None, obj),)), results)]
+    while True:
+        kind, _, items, results = stack[-1]
+        for name, value in items:
+            if isinstance(value, dict):
+                members = ((stringify_key(key, False), member) for key, member in value.items())
+                stack.append((OBJECT, name, members, []))
+                break
+            if isinstance(value, (list, tuple)):
+                stack.append((ARRAY, name, zip(itertools.repeat(None), value), []))
+                break
+            results.append((name, leaf(value)))
+        else:
+            if kind is None:
+                return results[0][1]
+            _, name, _, _ = stack.pop()
+            stack[-1][3].append((name, fold_object(results) if kind == OBJECT else fold_array(results)))
+
+
+@no_type_check
+class CanonicalDocument:
+    """Document keeping the canonical fragment of every subtree so edits only re-canonicalize the changed paths.
+
+    Edits are given as JSON Pointer (RFC 6901) paths or JSON Patch (RFC 6902) operations.
+    An edit encodes the new value (if any) and marks the nodes on the path to the root as stale together with the
+    slice of SLICE_SIZE children holding the changed child. The next request for the canonical bytes re-joins only
+    the stale slices of the stale nodes from the cached fragments of their children and concatenates the cached
+    fragments of the other slices, so the Python level work is proportional to the edit and the depth of the path
+    instead of the document size or the width of the containers. What stays linear is the byte copy of the
+    concatenations and the hashing of the digest.
+
+    Values that are neither dict, list, nor tuple (including objects resolved per the default hook of the encoder)
+    are leaves and can only be replaced as a whole.
+    """
+
+    @no_type_check
+    def __init__(self, obj, encoder=None, algorithm=api.DIGEST_ALGORITHM):
+        """Build the fragment tree of obj using the encoder (default: the canonical encoder) for the leaves."""
+        self.encoder = api.CANONICAL_ENCODER if encoder is None else encoder
+        # Builtin scalars skip the encoder machinery if the encoder is the canonical one
+        self._leaves = CANONICAL_LEAVES if self.encoder is api.CANONICAL_ENCODER else {}
+        self.algorithm = algorithm
+        self._digest = None
+        self._undo = None
+        self.root = self._build(obj)
+
+    @no_type_check
+    def _build(self, obj):
+        """Return the node tree for obj with all fragments set."""
+        leaves, encode = self._leaves, self.encoder.encode_utf8
+
+        @no_type_check
+        def _leaf(value):
+            leaf = leaves.get(type(value))
+            return Node(LEAF, value, None, encode(value) if leaf is None else leaf(value))
+
+        @no_type_check
+        def _object(members):
+            return _join(Node(OBJECT, children=dict(members)))
+
+        @no_type_check
+        def _array(elements):
+            return _join(Node(ARRAY, children=[child for _, child in elements]))
+
+        return fold(obj, _leaf, _object, _array)
+
+    @no_type_check
+    def _refresh(self, node):
+        """Rebuild the fragment of the node and its stale descendants bottom up with an explicit stack."""
+        stack = [node]
+        while stack:
+            current = stack[-1]
+            stale = [child for child in _changed_children(current) if child.fragment is None]
+            if stale:
+                stack.extend(stale)
+            else:
+                _join(stack.pop())
+        return node
+
+    @no_type_check
+    def _locate(self, tokens):
+        """Return the nodes from the root to the node at the reference tokens."""
+        path = [self.root]
+        for token in tokens:
+            node = path[-1]
+            if node.kind == OBJECT:
+                if token not in node.children:
+                    raise ValueError(f'member {token!r} of {format_pointer(tokens)!r} not found')
+                path.append(node.children[token])
+            elif node.kind == ARRAY:
+                path.append(node.children[_array_index(token, len(node.children), tokens)])
+            else:
+                raise ValueError(f'path {format_pointer(tokens)!r} descends into a scalar')
+        return path
+
+    @no_type_check
+    def _touch(self, path, tokens, undo):
+        """Mark the nodes on the path as stale and record the undo action if a patch is in progress.
+
+        The slices holding the children per the reference tokens are marked changed in all nodes but the last one
+        (the parent of the edit marks its changed slice itself as it knows whether a child was added or removed).
+        """
+        for node, token in zip(path[:-1], tokens):
+            _mark_child(node, token)
+        for node in path:
+            node.fragment = None
+        self._digest = None
+        if self._undo is not None:
+            self._undo.append(functools.partial(_revert, path, undo))
+
+    @no_type_check
+    def _set_root(self, node):
+        """Replace the root node and record the undo action if a patch is in progress."""
+        previous, self.root, self._digest = self.root, node, None
+        if self._undo is not None:
+            self._undo.append(functools.partial(setattr, self, 'root', previous))
+
+    @no_type_check
+    def get(self, pointer=''):
+        """Return the Python value at the JSON pointer (rebuilt from the tree, so O(size of the subtree))."""
+        return _to_python(self._locate(parse_pointer(pointer))[-1])
+
+    @no_type_check
+    def fragment(self, pointer=''):
+        """Return the canonical UTF-8 bytes of the value at the JSON pointer."""
+        path = self._locate(parse_pointer(pointer))
+        node = path[-1]
+        if node.fragment is None:
+            self._refresh(node)
+        return node.fragment
+
+    @no_type_check
+    def canonical(self):
+        """Return the canonical UTF-8 bytes of the document."""
+        return self.fragment()
+
+    @no_type_check
+    def digest(self):
+        """Return the hex digest of the canonical bytes per the hashlib algorithm of the document (cached per edit)."""
+        if self._digest is None:
+            self._digest = hashlib.new(self.algorithm, self.canonical()).hexdigest()
+        return self._digest
+
+    @no_type_check
+    def add(self, pointer, value):
+        """Add (or set) the object member or insert the array item (at index or - for the end) at the pointer."""
+        self._attach(parse_pointer(pointer), self._build(value), insert=True)
+
+    @no_type_check
+    def replace(self, pointer, value):
+        """Replace the existing value at the pointer."""
+        self._attach(parse_pointer(pointer), self._build(value), insert=False)
+
+    @no_type_check
+    def remove(self, pointer):
+        """Remove the value at the pointer and return it as Python value."""
+        return _to_python(self._detach(parse_pointer(pointer)))
+
+    @no_type_check
+    def move(self, from_pointer, pointer):
+        """Move the value at from_pointer to the pointer (reusing its fragments)."""
+        source, target = parse_pointer(from_pointer), parse_pointer(pointer)
+        if target[: len(source)] == source and len(target) > len(source):
+            raise ValueError(f'cannot move {from_pointer!r} into its own child {pointer!r}')
+        self._attach(target, self._detach(source), insert=True)
+
+    @no_type_check
+    def copy(self, from_pointer, pointer):
+        """Copy the value at from_pointer to the pointer (reusing its fragments)."""
+        node = self._locate(parse_pointer(from_pointer))[-1]
+        self._attach(parse_pointer(pointer), copy.deepcopy(node), insert=True)
+
+    @no_type_check
+    def test(self, pointer, value):
+        """Raise ValueError if the value at the pointer does not canonicalize like value."""
+        if self.fragment(pointer) != self.encoder.encode_utf8(value):
+            raise ValueError(f'test of {pointer!r} failed')
+
+    @no_type_check
+    def apply_patch(self, operations):
+        """Apply the JSON Patch (RFC 6902) operations in sequence.
+
+        Like the RFC demands, the patch is atomic: if an operation fails, the prior operations are undone in reverse
+        order (per the undo actions recorded by the edits) and the error is raised.
+        """
+        self._undo = []
+        try:
+            for operation in operations:
+                self._apply(operation)
+        except (KeyError, ValueError, TypeError):
+            for action in reversed(self._undo):
+                action()
+            self._digest = None
+            raise
+        finally:
+            self._undo = None
+
+    @no_type_check
+    def _apply(self, operation):
+        """Apply a single JSON Patch operation."""
+        op = operation.get('op')
+        if op not in PATCH_OPERATIONS:
+            raise ValueError(f'unknown patch operation {op!r}')
+        if op == 'remove':
+            self.remove(operation['path'])
+        elif op in ('move', 'copy'):
+            getattr(self, op)(operation['from'], operation['path'])
+        else:
+            getattr(self, op)(operation['path'], operation['value'])
+
+    @no_type_check
+    def _attach(self, tokens, node, insert):
+        """Attach the node at the reference tokens (adding if insert else replacing) and mark the path stale."""
+        if not tokens:
+            return self._set_root(node)
+        path = self._locate(tokens[:-1])
+        parent, token = path[-1], tokens[-1]
+        children = parent.children
+        if parent.kind == OBJECT:
+            previous = children.get(token)
+            if previous is None:
+                if not insert:
+                    raise ValueError(f'member {token!r} of {format_pointer(tokens)!r} not found')
+                _insert_member(parent, token)
+                undo = functools.partial(_forget, parent, token)
+            else:
+                _mark_child(parent, token)
+                undo = functools.partial(children.__setitem__, token, previous)
+            children[token] = node
+        elif parent.kind == ARRAY:
+            size = len(children)
+            if insert:
+                index = size if token == APPEND_INDEX else _array_index(token, size + 1, tokens)
+                children.insert(index, node)
+                _mark(parent, index, 1)
+                undo = functools.partial(children.pop, index)
+            else:
+                index = _array_index(token, size, tokens)
+                undo = functools.partial(children.__setitem__, index, children[index])
+                children[index] = node
+                _mark(parent, index)
+        else:
+            raise ValueError(f'path {format_pointer(tokens)!r} descends into a scalar')
+        self._touch(path, tokens, undo)
+
+    @no_type_check
+    def _detach(self, tokens):
+        """Detach and return the node at the reference tokens and mark the path stale."""
+        if not tokens:
+            raise ValueError('cannot remove the document root')
+        path = self._locate(tokens)
+        parent, token = path[-2], tokens[-1]
+        if parent.kind == OBJECT:
+            _remove_member(parent, token)
+            node = parent.children.pop(token)
+            undo = functools.partial(_restore, parent, token, node)
+        else:
+            index = _array_index(token, len(parent.children), tokens)
+            node = parent.children.pop(index)
+            _mark(parent, index, -1)
+            undo = functools.partial(parent.children.insert, index, node)
+        self._touch(path[:-1], tokens, undo)
+        return node
+
+
+@no_type_check
+def _array_index(token, size, tokens):
+    """Return the array index per the reference token if it is within range(size) else raise ValueError."""
+    if not token.isdigit() or (token.startswith('0') and token != '0'):
+        raise ValueError(f'invalid array index {token!r} in {format_pointer(tokens)!r}')
+    index = int(token)
+    if index >= size:
+        raise ValueError(f'array index {index} of {format_pointer(tokens)!r} out of range')
+    return index
+
+
+@no_type_check
+def _sort_key(name):
+    """Return the key ordering the member names canonically."""
+    return name.encode(ENCODING_FOR_SORT)
+
+
+@no_type_check
+def _member_index(order, name):
+    """Return the index of the member name in (or for inserting it into) the canonically ordered member names."""
+    key, low, high = _sort_key(name), 0, len(order)
+    while low < high:
+        middle = (low + high) // 2
+        if _sort_key(order[middle]) < key:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+@no_type_check
+def _mark_child(node, token):
+    """Mark the slice holding the child at the (valid) reference token of the container node as changed."""
+    if node.chunks is not None:
+        _mark(node, int(token) if node.kind == ARRAY else _member_index(node.order, token))
+
+
+@no_type_check
+def _mark(node, position, delta=0):
+    """Mark the slice holding the child at position as changed (with delta children added or removed).
+
+    Nothing is marked for nodes not joined yet (or with the member order stale), as all their slices are rebuilt.
+    """
+    if node.chunks is None:
+        return
+    ends = list(itertools.accumulate(node.sizes))
+    if not ends:
+        node.chunks = None
+        return
+    index = min(bisect.bisect_right(ends, position), len(ends) - 1)
+    node.sizes[index] += delta
+    node.dirty.add(index)
+
+
+@no_type_check
+def _insert_member(node, name):
+    """Insert the new member name into the canonical order of the object node and mark its slice changed."""
+    if node.order is None:
+        return
+    index = _member_index(node.order, name)
+    # The shared (cached) tuple of member names is copied into a list owned by the node on the first change
+    node.order = node.order if isinstance(node.order, list) else list(node.order)
+    node.order.insert(index, name)
+    _mark(node, index, 1)
+
+
+@no_type_check
+def _remove_member(node, name):
+    """Remove the member name from the canonical order of the object node and mark its slice changed."""
+    if node.order is None:
+        return
+    index = _member_index(node.order, name)
+    node.order = node.order if isinstance(node.order, list) else list(node.order)
+    del node.order[index]
+    _mark(node, index, -1)
+
+
+@no_type_check
+def _members(node):
+    """Return the sequence of children (arrays) or member names (objects) in output order."""
+    return node.children if node.kind == ARRAY else node.order
+
+
+@no_type_check
+def _changed_children(node):
+    """Return the children of the container node in the slices changed since the last join (all if not joined)."""
+    children = node.children
+    if node.chunks is None:
+        return list(children.values()) if node.kind == OBJECT else children
+    members, ends, changed = _members(node), list(itertools.accumulate(node.sizes)), []
+    for index in node.dirty:
+        changed.extend(members[ends[index] - node.sizes[index] : ends[index]])
+    return changed if node.kind == ARRAY else [children[name] for name in changed]
+
+
+@no_type_check
+def _join_slice(node, members):
+    """Return the canonical UTF-8 fragments of the slice of children (arrays) or member names (objects) joined."""
+    if node.kind == ARRAY:
+        return COMMA.join([child.fragment for child in members])
+    children = node.children
+    return COMMA.join([member_prefix(name) + children[name].fragment for name in members])
+
+
+@no_type_check
+def _join(node):
+    """Set and return the fragment of the container node joined from the cached and the changed slices.
+
+    Changed slices are re-joined from the (fresh) fragments of their children, emptied slices are dropped, and
+    slices grown beyond twice the SLICE_SIZE are split, so the slices of every container stay bounded.
+    """
+    if node.kind == OBJECT and node.order is None:
+        node.order, node.chunks = canonical_order(tuple(node.children)), None
+    members = _members(node)
+    if node.chunks is None:
+        node.sizes, node.chunks, node.dirty = [len(members)], [None], {0}
+    sizes, chunks, ends = node.sizes, node.chunks, list(itertools.accumulate(node.sizes))
+    for index in sorted(node.dirty, reverse=True):
+        start, stop = ends[index] - sizes[index], ends[index]
+        step = SLICE_SIZE if stop - start > 2 * SLICE_SIZE else max(stop - start, 1)
+        bounds = [(low, min(low + step, stop)) for low in range(start, stop, step)]
+        sizes[index : index + 1] = [high - low for low, high in bounds]
+        chunks[index : index + 1] = [_join_slice(node, members[low:high]) for low, high in bounds]
+    node.dirty = set()
+    # Joining the brackets with the joined slices copies the (possibly large) slices only once
+    brackets = (OPEN_SB, CLOSE_SB) if node.kind == ARRAY else (OPEN_CB, CLOSE_CB)
+    node.fragment = COMMA.join(chunks).join(brackets)
+    return node
+
+
+@no_type_check
+def _forget(node, name):
+    """Remove the member name from the object node."""
+    del node.children[name]
+    node.order, node.chunks = None, None
+
+
+@no_type_check
+def _restore(node, name, child):
+    """Add the member name with the child node to the object node."""
+    node.children[name] = child
+    node.order, node.chunks = None, None
+
+
+@no_type_check
+def _revert(path, undo):
+    """Apply the undo action of an edit and mark the nodes on its path as stale with all their slices."""
+    undo()
+    for node in path:
+        node.fragment, node.chunks = None, None
+
+
+@no_type_check
+def _to_python(node):
+    """Return the Python value for the node tree."""
+    if node.kind == OBJECT:
+        return {name: _to_python(child) for name, child in node.children.items()}
+    if node.kind == ARRAY:
+        return [_to_python(child) for child in node.children]
+    return node.value
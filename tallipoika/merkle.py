@@ -0,0 +1,148 @@
+"""Trees of digests over the canonical form with one digest per object member and array element."""
+
+import hashlib
+from typing import no_type_check
+
+import tallipoika.api as api
+from tallipoika.document import (
+    CANONICAL_LEAVES,
+    CLOSE_CB,
+    CLOSE_SB,
+    COMMA,
+    OPEN_CB,
+    OPEN_SB,
+    canonical_order,
+    fold,
+    format_pointer,
+    member_prefix,
+    parse_pointer,
+)
+
+
+@no_type_check
+class DigestTree:
+    """The digest of the canonical UTF-8 form of a value together with the trees of its members or elements.
+
+    The digest of every node equals the digest of canonicalize applied to the value of that node,
+    so the digest of the root equals canonical_digest of the document (for the same algorithm).
+    Objects hold a dict of member name to tree, arrays a list of trees, and all other values None as children.
+    """
+
+    __slots__ = ('digest', 'children')
+
+    @no_type_check
+    def __init__(self, digest, children=None):
+        self.digest = digest
+        self.children = children
+
+    @no_type_check
+    def hexdigest(self):
+        """Return the digest as hex string."""
+        return self.digest.hex()
+
+    @no_type_check
+    def find(self, pointer):
+        """Return the tree at the JSON pointer (RFC 6901) or raise ValueError if there is none."""
+        tree = self
+        for token in parse_pointer(pointer):
+            children = tree.children
+            if isinstance(children, dict) and token in children:
+                tree = children[token]
+            elif isinstance(children, list) and token.isdigit() and int(token) < len(children):
+                tree = children[int(token)]
+            else:
+                raise ValueError(f'no tree at {pointer!r}')
+        return tree
+
+
+@no_type_check
+def digest_tree(obj, algorithm=api.DIGEST_ALGORITHM, encoder=None):
+    """Return the digest tree of obj per the hashlib algorithm name.
+
+    Values that are no builtin scalars, dicts, lists, or tuples are encoded as a whole by the encoder
+    (default: the canonical encoder) and become leaves.
+    The tree is built bottom up (without recursion), and the canonical fragment of a subtree is only kept until
+    its parent is hashed, so the memory needed is about the size of the canonical form plus the tree.
+    The bytes hashed add up to the size of the canonical form times the nesting depth.
+    """
+    encoder = api.CANONICAL_ENCODER if encoder is None else encoder
+    leaves = CANONICAL_LEAVES if encoder is api.CANONICAL_ENCODER else {}
+
+    @no_type_check
+    def _hash(fragment):
+        return hashlib.new(algorithm, fragment).digest()
+
+    @no_type_check
+    def _leaf(value):
+        """Return the canonical fragment and the digest tree of the leaf value."""
+        leaf = leaves.get(type(value))
+        fragment = encoder.encode_utf8(value) if leaf is None else leaf(value)
+        return fragment, DigestTree(_hash(fragment))
+
+    @no_type_check
+    def _object(members):
+        """Return the canonical fragment and the digest tree of the object from the pairs of its members."""
+        built = dict(members)
+        fragments = [member_prefix(name) + built[name][0] for name in canonical_order(tuple(built))]
+        fragment = OPEN_CB + COMMA.join(fragments) + CLOSE_CB
+        return fragment, DigestTree(_hash(fragment), {name: tree for name, (_, tree) in members})
+
+    @no_type_check
+    def _array(elements):
+        """Return the canonical fragment and the digest tree of the array from the pairs of its elements."""
+        fragment = OPEN_SB + COMMA.join([fragment for _, (fragment, _) in elements]) + CLOSE_SB
+        return fragment, DigestTree(_hash(fragment), [tree for _, (_, tree) in elements])
+
+    return fold(obj, _leaf, _object, _array)[1]
+
+
+@no_type_check
+def _pairs(lefts, rights):
+    """Return the keys of the differing children in document order with both children (None for a missing side)."""
+    if isinstance(lefts, dict) and isinstance(rights, dict):
+        names = list(lefts.keys() ^ rights.keys())
+        names.extend(name for name in lefts.keys() & rights.keys() if lefts[name].digest != rights[name].digest)
+        return [(name, lefts.get(name), rights.get(name)) for name in canonical_order(tuple(names))]
+    if isinstance(lefts, list) and isinstance(rights, list):
+        common = min(len(lefts), len(rights))
+        pairs = [(index, lefts[index], rights[index]) for index in range(common)]
+        pairs = [(index, left, right) for index, left, right in pairs if left.digest != right.digest]
+        pairs.extend((index, None, None) for index in range(common, max(len(lefts), len(rights))))
+        return pairs
+    return None
+
+
+@no_type_check
+def diff(left, right):
+    """Return the JSON pointers of the outermost differing values that cannot be narrowed down further.
+
+    Only differing digests are descended into, so the work follows the differences instead of the document sizes.
+    Members present on one side only and elements beyond the common length of arrays are reported each,
+    values that changed their type (and changed leaves) are reported as a whole.
+    The pointers are in document order (members sorted by name).
+    """
+    pointers = []
+    stack = [((), left, right)]
+    while stack:
+        tokens, left, right = stack.pop()
+        if left is None or right is None:
+            pointers.append(format_pointer(tokens))
+            continue
+        if left.digest == right.digest:
+            continue
+        pairs = _pairs(left.children, right.children)
+        if pairs is None:
+            pointers.append(format_pointer(tokens))
+            continue
+        # pushed in reverse, so the children pop in document order
+        stack.extend(((*tokens, key), lefts, rights) for key, lefts, rights in reversed(pairs))
+    return pointers
+
+
+@no_type_check
+def verify(tree, pointer, value, algorithm=api.DIGEST_ALGORITHM):
+    """Return True if the value canonicalizes to the digest recorded in the tree at the JSON pointer.
+
+    Only the value itself is canonicalized, so a changed subtree can be re-verified without the rest of the document.
+    """
+    return api.canonical_hasher(value, hashlib.new(algorithm)).digest() == tree.find(pointer).digest
@@ -1,7 +1,9 @@
 """Serialize a Python numerical value as an ECMAScript v6 or later string."""
 
+import functools
 import math
-from typing import Union, no_type_check
+import re
+from typing import Iterable, Sequence, Union, no_type_check
 
 DASH = '-'
 D_POINT = '.'
@@ -9,16 +11,30 @@ DIGIT_ZERO = '0'
 MIN_INTEGER_DIGITS = 0
 MAX_INTEGER_DIGITS = 21
 REPR_SWITCH_ABOVE = -7
+EXPONENT_MARKER = 'e'
+FLOAT_TAIL = '.0'
+SAFE_INTEGER_LIMIT = 2**53  # integers of smaller magnitude are exactly representable as IEEE 754 double
+SMALL_INT_MIN = -256
+SMALL_INT_MAX = 1024
+SMALL_INTS = tuple(str(n) for n in range(SMALL_INT_MIN, SMALL_INT_MAX))
+# The bulk formatters work on the reprs joined by comma (which no repr contains) matching whole items per lookarounds
+JOIN_SEPARATOR = ','
+NON_FINITE_MARKER = 'n'  # only nan and inf contain this letter
+FLOAT_TAIL_ITEM = re.compile(r'\.0(?![^,])')
+EXPONENT_ITEM = re.compile(r'[^,]*e[^,]*')
+MINUS_ZERO = '-0'
+MINUS_ZERO_ITEM = re.compile(r'(?<![^,])-0(?![^,])')
 
 
 @no_type_check
-def serialize(number: Union[float, int]) -> str:
-    """Serialize a Python builtin number as an ECMAScript v6 or later string.
+def _format_float(as_float: float) -> str:
+    """Serialize a finite and non-zero Python float as an ECMAScript v6 or later string.
 
     Implementation Note(s):
 
-    - (builtin) numbers are for now int and float but may be extended to other types that can be mapped to JSON numbers
-    - separate into the components:
+    - the repr of a float already is the shortest round-tripping digit string (as required by ES6)
+    - the repr uses positional notation for magnitudes in [1e-4, 1e16) where ES6 uses it for [1e-6, 1e21), so only
+      texts with an exponent need to be separated into the components:
       + sign
       + integral part
       + decimal point
@@ -26,23 +42,17 @@ def serialize(number: Union[float, int]) -> str:
       + exponent part
     - return the concatenation of the components (some components may be empty)
     """
-    if not math.isfinite(number):
-        raise ValueError(f'invalid number ({number})')
+    as_text = repr(as_float)
+    if EXPONENT_MARKER not in as_text:
+        return as_text[:-2] if as_text.endswith(FLOAT_TAIL) else as_text
 
-    as_float = float(number)
-    if as_float == 0:
-        return DIGIT_ZERO
-
-    as_text = str(as_float)
     sign = DASH if as_text[0] == DASH else ''
     magnitude = as_text[1:] if sign else as_text
-    mantissa = magnitude
-    e_part, e_number = '', 0
-    if (exp_ndx := magnitude.find('e')) > 0:
-        mantissa, e_part = magnitude[0:exp_ndx], magnitude[exp_ndx:]
-        if e_part[2:3] == '0':  # remove leading zero of exponent representation
-            e_part = f'{e_part[:2]}{e_part[3:]}'
-        e_number = int(e_part[1:])
+    exp_ndx = magnitude.find(EXPONENT_MARKER)
+    mantissa, e_part = magnitude[0:exp_ndx], magnitude[exp_ndx:]
+    if e_part[2:3] == '0':  # remove leading zero of exponent representation
+        e_part = f'{e_part[:2]}{e_part[3:]}'
+    e_number = int(e_part[1:])
 
     i_part, d_point, f_part = mantissa, '', ''
     if (dec_ndx := mantissa.find(D_POINT)) > 0:
@@ -61,3 +71,99 @@ def serialize(number: Union[float, int]) -> str:
         return f'{sign}{DIGIT_ZERO}{D_POINT}{DIGIT_ZERO * down_shifts}{i_part}{f_part}'  # no exponential representation
 
     return f'{sign}{i_part}{d_point}{f_part}{e_part}'
+
+
+_float_formatter = _format_float
+
+
+@no_type_check
+def set_float_cache(maxsize: int) -> None:
+    """Memoize the serialization of up to maxsize recurring float values (0 disables the cache - the default)."""
+    global _float_formatter  # pylint: disable=global-statement
+    _float_formatter = functools.lru_cache(maxsize=maxsize)(_format_float) if maxsize > 0 else _format_float
+
+
+@no_type_check
+def float_cache_info():
+    """Return the hits, misses, maxsize, and currsize of the float cache as named tuple or None if disabled."""
+    return _float_formatter.cache_info() if _float_formatter is not _format_float else None
+
+
+@no_type_check
+def _serializer(_isinstance=isinstance, _int=int, _float=float, _int_repr=int.__repr__, _small_ints=SMALL_INTS):
+    """Return serialize with the names of its hot path bound in the closure (faster to look up than globals)."""
+
+    @no_type_check
+    def serialize(number: Union[float, int]) -> str:
+        """Serialize a Python builtin number as an ECMAScript v6 or later string.
+
+        Implementation Note(s):
+
+        - (builtin) numbers are for now int and float but may be extended to other types that can be mapped to
+          JSON numbers
+        - integers of magnitude below 2**53 are exact as double, so their decimal representation is already the ES6 one
+          (int.__repr__ also maps subclasses like bool or IntEnum members to their numerical value)
+        - all other numbers are converted to float and formatted by _format_float (optionally memoized)
+        """
+        if _isinstance(number, _int):
+            if -SAFE_INTEGER_LIMIT < number < SAFE_INTEGER_LIMIT:
+                if SMALL_INT_MIN <= number < SMALL_INT_MAX:
+                    return _small_ints[number - SMALL_INT_MIN]
+                return _int_repr(number)
+
+        as_float = _float(number)  # raises OverflowError for integers beyond the double range
+        if not math.isfinite(as_float):
+            raise ValueError(f'invalid number ({number})')
+
+        if as_float == 0:
+            return DIGIT_ZERO
+
+        return _float_formatter(as_float)
+
+    serialize.__qualname__ = serialize.__name__  # pickled by reference to the module level name
+    return serialize
+
+
+serialize = _serializer()
+
+
+@no_type_check
+def serialize_many(sequence: Iterable[Union[float, int]]) -> list[str]:
+    """Serialize all Python builtin numbers of sequence as ECMAScript v6 or later strings."""
+    return list(map(serialize, sequence))
+
+
+@no_type_check
+def join_floats(floats: Sequence[float], separator: str = JOIN_SEPARATOR) -> str:
+    """Serialize the Python floats of sequence as ECMAScript v6 or later strings joined by separator.
+
+    Implementation Note(s):
+
+    - the bulk variant of serialize for sequences of exact floats (no subclasses)
+    - the reprs are formatted and joined in one pass without a Python call per item, and only the items that
+      differ from their ES6 form (tail of .0, exponent, minus zero) are patched by regular expression substitutions
+    - sequences holding any nan or inf take the per item path, so serialize raises for the offending item
+    """
+    text = JOIN_SEPARATOR.join(map(float.__repr__, floats))
+    if NON_FINITE_MARKER in text:
+        return separator.join(map(serialize, floats))
+    text = FLOAT_TAIL_ITEM.sub('', text)
+    if EXPONENT_MARKER in text:
+        text = EXPONENT_ITEM.sub(lambda match: _float_formatter(float(match.group())), text)
+    if f'{MINUS_ZERO}{JOIN_SEPARATOR}' in text or text.endswith(MINUS_ZERO):  # rare, so test before the scan
+        text = MINUS_ZERO_ITEM.sub(DIGIT_ZERO, text)
+    return text if separator == JOIN_SEPARATOR else text.replace(JOIN_SEPARATOR, separator)
+
+
+@no_type_check
+def join_ints(ints: Sequence[int], separator: str = JOIN_SEPARATOR) -> str:
+    """Serialize the Python ints of sequence as ECMAScript v6 or later strings joined by separator.
+
+    Implementation Note(s):
+
+    - the bulk variant of serialize for sequences of exact ints (no subclasses like bool)
+    - if all magnitudes are below 2**53 (checked per min and max) the decimal reprs already are the ES6 ones
+    """
+    if -SAFE_INTEGER_LIMIT < min(ints) and max(ints) < SAFE_INTEGER_LIMIT:
+        return separator.join(map(int.__repr__, ints))
+    return separator.join(map(serialize, ints))
@@ -0,0 +1,78 @@
+import asyncio
+import concurrent.futures
+
+import pytest
+
+import tallipoika.aio as aio
+from tallipoika.api import canonicalize, canonicalize_chunks, serialize
+
+DATA = {'b': [n / 7 for n in range(5000)], 'a': [{'z': str(n), 'y': None} for n in range(5000)]}
+
+
+class Writer:
+    """Stream writer double recording the data written and the drains awaited."""
+
+    def __init__(self):
+        self.data = bytearray()
+        self.drains = 0
+
+    def write(self, data):
+        self.data += data
+
+    async def drain(self):
+        self.drains += 1
+
+
+async def collect(chunks):
+    return [chunk async for chunk in chunks]
+
+
+@pytest.mark.parametrize('offload', [False, True])
+def test_canonicalize_chunks(offload):
+    chunks = asyncio.run(collect(aio.canonicalize_chunks(DATA, chunk_size=1024, offload=offload)))
+    assert len(chunks) > 1
+    assert all(len(chunk) >= 1024 for chunk in chunks[:-1])
+    assert b''.join(chunks) == canonicalize(DATA)
+    assert b''.join(asyncio.run(collect(aio.serialize_chunks(DATA, offload=offload)))) == serialize(DATA)
+
+
+def test_canonicalize_to_drains_per_chunk():
+    writer = Writer()
+    size = asyncio.run(aio.canonicalize_to(writer, DATA, chunk_size=4096))
+    assert writer.data == canonicalize(DATA)
+    assert size == len(writer.data)
+    assert writer.drains == len(list(canonicalize_chunks(DATA, chunk_size=4096)))
+
+
+def test_serialize_to_with_executor():
+    writer = Writer()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        size = asyncio.run(aio.serialize_to(writer, DATA, offload=True, executor=executor))
+    assert writer.data == serialize(DATA)
+    assert size == len(writer.data)
+
+
+@pytest.mark.parametrize('offload', [False, True])
+def test_other_tasks_keep_running_while_encoding(offload):
+    async def main():
+        ticks = 0
+        done = asyncio.Event()
+
+        async def ticker():
+            nonlocal ticks
+            while not done.is_set():
+                ticks += 1
+                await asyncio.sleep(0)
+
+        task = asyncio.create_task(ticker())
+        await aio.canonicalize_to(Writer(), DATA, chunk_size=1024, offload=offload)
+        done.set()
+        await task
+        return ticks
+
+    assert asyncio.run(main()) > 10
+
+
+def test_encoding_errors_propagate():
+    with pytest.raises(TypeError, match='is not JSON serializable'):
+        asyncio.run(aio.canonicalize_to(Writer(), {'a': object()}))
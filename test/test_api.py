@@ -1,7 +1,34 @@
+import array
+import collections
+import concurrent.futures
+import enum
+import hashlib
+import io
 import json
 import pathlib
+import sys
+import tracemalloc
 
-from tallipoika.api import canonicalize
+import pytest
+
+import tallipoika.api as api
+from tallipoika.api import (
+    CANONICAL_ENCODER,
+    ENGINE_STR,
+    ENGINE_UTF8,
+    JSONEncoder,
+    canonical_digest,
+    canonical_hasher,
+    canonicalize,
+    canonicalize_chunks,
+    canonicalize_into,
+    canonicalize_many,
+    canonicalize_text,
+    serialize,
+    serialize_many,
+    shape_cache_clear,
+    shape_cache_info,
+)
 
 ENCODING = 'utf-8'
 NL = '\n'
@@ -24,3 +51,442 @@ def test_upstream():
 
         assert actual == expected
         assert actual == recycled
+
+
+def test_one_shot_matches_iterencode():
+    encoder = JSONEncoder()
+    for case in sorted(input_data_root.glob('*.json')):
+        with open(case, 'r', encoding=ENCODING) as source:
+            data = json.load(source)
+        assert encoder.encode(data) == ''.join(encoder.iterencode(data))
+
+
+def test_one_shot_non_string_keys_and_indent():
+    data = {'b': [1.5, None, True], 2: {}, None: (), 'a': 1e21}
+    encoder = JSONEncoder(indent=2)
+    assert encoder.encode(data) == ''.join(encoder.iterencode(data))
+    assert canonicalize(data) == b'{"2":{},"a":1e+21,"b":[1.5,null,true],"null":[]}'
+
+
+def test_one_shot_circular_reference():
+    data = [1]
+    data.append(data)
+    with pytest.raises(ValueError, match='circular reference detected'):
+        canonicalize(data)
+
+
+def test_shape_cache_hits_for_repeated_records():
+    shape_cache_clear()
+    records = [{'z': i, 'a': str(i), 'ä': None} for i in range(100)]
+    assert canonicalize(records).startswith(b'[{"a":"0","z":0,"\xc3\xa4":null},{"a":"1"')
+    info = shape_cache_info()
+    assert info.misses == 1
+    assert info.hits == 99
+    assert canonicalize({2: 'b', 1: 'a'}) == b'{"1":"a","2":"b"}'
+    assert canonicalize({2.0: 'b', True: 'a'}) == b'{"1":"a","2":"b"}'
+
+
+def test_canonicalize_chunks_coalesced():
+    data = {'b': ['ü' * 10, 1.5e-7], 'a': list(range(100_000))}
+    chunks = list(canonicalize_chunks(data, chunk_size=64))
+    assert len(chunks) > 1
+    assert all(len(chunk) >= 64 for chunk in chunks[:-1])
+    assert b''.join(chunks) == canonicalize(data)
+
+
+def test_canonical_digest_matches_hash_of_canonicalize():
+    data = {'b': ['ü' * 1000, 1.5e-7], 'a': list(range(1000))}
+    assert canonical_digest(data) == hashlib.sha256(canonicalize(data)).hexdigest()
+    assert canonical_digest(data, 'blake2b', chunk_size=10) == hashlib.blake2b(canonicalize(data)).hexdigest()
+    hasher = canonical_hasher(data, hashlib.sha1())
+    assert hasher.hexdigest() == hashlib.sha1(canonicalize(data)).hexdigest()
+
+
+def test_utf8_engine_matches_str_engine():
+    data = {'ü': ['€', '\n', 1.5e-7, None, True, {}, []], 'a': {'b': [1, 2.0, 'x']}, 3: False}
+    for indent in (None, 1):
+        encoder = JSONEncoder(indent=indent)
+        assert encoder.encode_utf8(data) == encoder.encode(data).encode()
+    assert canonicalize(data, utf8=False).encode() == canonicalize(data)
+    sink = bytearray(b'>')
+    assert canonicalize_into(data, sink) is sink
+    assert sink == b'>' + canonicalize(data)
+
+
+def test_encode_utf8_does_not_copy_the_document():
+    data = [{'id': n, 'name': f'item-{n}', 'values': [n / 7, None]} for n in range(20_000)]
+    tracemalloc.start()
+    try:
+        encoded = canonicalize(data)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 1.5 * len(encoded)
+
+
+def test_canonicalize_and_serialize_many():
+    items = [{'b': i, 'a': [i / 2, None]} for i in range(5)] + ['x', 7]
+    assert list(canonicalize_many(items)) == [canonicalize(item) for item in items]
+    assert list(canonicalize_many(iter(items), utf8=False)) == [canonicalize(item, utf8=False) for item in items]
+    assert list(serialize_many(items)) == [serialize(item) for item in items]
+
+
+def test_encoder_reuses_built_engine_until_configuration_changes():
+    encoder = JSONEncoder()
+    built = encoder.engine(ENGINE_STR)
+    assert encoder.encode({'b': 1, 'a': [2]}) == '{"a":[2],"b":1}'
+    assert encoder.engine(ENGINE_STR) is built
+    encoder.sort_keys = False
+    assert encoder.engine(ENGINE_STR) is not built
+    assert encoder.encode({'b': 1, 'a': [2]}) == '{"b":1,"a":[2]}'
+    encoder.default = lambda obj: sorted(obj)
+    assert encoder.encode({'s': {3, 1}}) == '{"s":[1,3]}'
+    assert canonicalize({'b': 1, 'a': 2}) == b'{"a":2,"b":1}'
+    assert CANONICAL_ENCODER.engine(ENGINE_UTF8) is CANONICAL_ENCODER.engine(ENGINE_UTF8)
+
+
+def test_encoder_ignores_allow_nan():
+    encoder = JSONEncoder()
+    built = encoder.engine(ENGINE_STR)
+    encoder.allow_nan = False
+    assert encoder.engine(ENGINE_STR) is built
+    for allow_nan in (True, False):
+        with pytest.raises(ValueError, match='invalid number'):
+            JSONEncoder(allow_nan=allow_nan).encode([float('nan')])
+
+
+def test_subclasses_take_the_fallback_path():
+    class Level(enum.IntEnum):
+        HIGH = 3
+
+    class Name(str):
+        def __str__(self):
+            return 'ignored'
+
+    data = collections.OrderedDict(b=[Level.HIGH, Name('x'), 1.5], a=collections.defaultdict(list, z=(True,)))
+    expected = '{"a":{"z":[true]},"b":[3,"x",1.5]}'
+    encoder = JSONEncoder()
+    assert encoder.encode(data) == expected
+    assert ''.join(encoder.iterencode(data)) == expected
+    assert encoder.encode_utf8(data) == expected.encode()
+
+
+def test_deeply_nested_beyond_recursion_limit():
+    depth = 100_000
+    data = [0]
+    for _ in range(depth):
+        data = [{'a': data}]
+    expected = '[{"a":' * depth + '[0]' + '}]' * depth
+    encoder = JSONEncoder(sort_keys=True, separators=(',', ':'))
+    assert encoder.encode(data) == expected
+    assert ''.join(encoder.iterencode(data)) == expected
+    assert canonicalize(data) == expected.encode()
+
+
+def test_deeply_nested_indent_matches_shallow_engine():
+    data = 'leaf'
+    for level in range(300):
+        data = {'k': [data, level]} if level % 2 else [data, {}]
+    encoder = JSONEncoder(indent=1, sort_keys=True)
+    expected = json.dumps(data, indent=1, sort_keys=True, separators=(',', ':'))
+    assert encoder.encode(data) == ''.join(encoder.iterencode(data)) == expected
+
+
+def test_trusted_mode_matches_marker_tracking():
+    data = {'b': [1, {'c': None}], 'a': [[[]], {'d': 'e'}], 'x': ()}
+    trusted = JSONEncoder(trusted=True)
+    assert trusted.encode(data) == JSONEncoder().encode(data)
+    assert ''.join(trusted.iterencode(data)) == trusted.encode(data)
+    assert bytes(trusted.encode_into(data, bytearray())) == trusted.encode_utf8(data) == canonicalize(data)
+
+
+@pytest.mark.parametrize('max_depth', (1, 3, 300))
+def test_trusted_mode_max_depth(max_depth):
+    data = []
+    for _ in range(max_depth):
+        data = [data, 0]
+    encoder = JSONEncoder(trusted=True, max_depth=max_depth)
+    assert encoder.encode(data) == JSONEncoder().encode(data)
+    deeper = JSONEncoder(trusted=True, max_depth=max_depth - 1)
+    with pytest.raises(ValueError, match='maximum nesting depth'):
+        deeper.encode(data)
+    with pytest.raises(ValueError, match='maximum nesting depth'):
+        list(deeper.iterencode(data))
+
+
+def test_trusted_mode_stops_circular_reference():
+    data = {'a': []}
+    data['a'].append(data)
+    encoder = JSONEncoder(trusted=True, max_depth=50)
+    with pytest.raises(ValueError, match='maximum nesting depth of 50'):
+        encoder.encode(data)
+    with pytest.raises(ValueError, match='maximum nesting depth of 50'):
+        list(encoder.iterencode(data))
+
+
+def test_trusted_mode_stops_default_hook_loop():
+    class Opaque:
+        pass
+
+    encoder = JSONEncoder(trusted=True, max_depth=50, default=lambda obj: obj)
+    for encode in (encoder.encode, encoder.encode_utf8, lambda obj: ''.join(encoder.iterencode(obj))):
+        with pytest.raises(ValueError, match='maximum depth of 50 exceeded in default hook calls'):
+            encode([Opaque()])
+
+
+def test_unchecked_circular_reference_stops_at_recursion_limit():
+    data = {'a': []}
+    data['a'].append(data)
+    limit = sys.getrecursionlimit()
+    for encoder in (JSONEncoder(check_circular=False), JSONEncoder(trusted=True, max_depth=None)):
+        with pytest.raises(ValueError, match=f'maximum nesting depth of {limit}'):
+            encoder.encode(data)
+        with pytest.raises(ValueError, match=f'maximum nesting depth of {limit}'):
+            list(encoder.iterencode(data))
+
+
+def test_collect_stats_counts_lone_surrogates():
+    data = ['\ud800', 'ü']
+    encoder = JSONEncoder(collect_stats=True)
+    assert encoder.encode(data) == JSONEncoder().encode(data) == '["\ud800","ü"]'
+    assert encoder.stats['bytes_emitted'] == 12
+    assert ''.join(encoder.iterencode(data)) == '["\ud800","ü"]'
+    assert encoder.stats['bytes_emitted'] == 12
+
+
+def test_collect_stats_counts_work_per_call():
+    class Rank(enum.IntEnum):
+        TOP = 1
+
+    data = {'b': [1, 2.5, 'x', {'z': None, 'y': 'ü'}], 'a': {2, 1}, 'c': Rank.TOP, 'd': []}
+    text = JSONEncoder(default=sorted).encode(data)
+    expected = {'containers': 5, 'numbers': 5, 'strings': 2, 'default_calls': 1, 'bytes_emitted': len(text.encode())}
+    encoder = JSONEncoder(collect_stats=True, default=sorted)
+    assert encoder.stats is None
+    for encode in (encoder.encode, encoder.encode_utf8, lambda obj: ''.join(encoder.iterencode(obj))):
+        shape_cache_clear()
+        encode(data)
+        assert {name: encoder.stats[name] for name in expected} == expected
+        assert encoder.stats['keys_sorted'] == 6
+        assert encoder.stats['sort_seconds'] > 0 and encoder.stats['format_seconds'] > 0
+    encode(data)
+    assert encoder.stats['keys_sorted'] == 0  # all shapes served from the cache
+
+
+def test_collect_stats_off_builds_plain_engines():
+    plain, counting = JSONEncoder(), JSONEncoder(collect_stats=True)
+    assert plain.engine('str').__name__ == '_one_shot'
+    assert counting.engine('str').__name__ == '_encode'
+    plain.encode([1])
+    assert plain.stats is None
+
+
+@pytest.mark.parametrize('indent', (None, 2))
+def test_memoize_emits_fragments_of_shared_objects(indent):
+    block = {'name': 'cfg', 'values': [1, 2.5, 'ü'], 'nested': {'a': []}}
+    data = {'a': [block] * 3, 'b': [{'k': block}] * 2, 'c': block, 'd': (block, [block])}
+    plain, memo = JSONEncoder(indent=indent), JSONEncoder(indent=indent, memoize=True)
+    assert memo.encode(data) == plain.encode(data)
+    assert ''.join(memo.iterencode(data)) == plain.encode(data)
+    assert memo.encode_utf8(data) == plain.encode_utf8(data)
+
+
+def test_memoize_keeps_default_results_alive():
+    class Point:
+        def __init__(self, x):
+            self.x = x
+
+    data = [Point(n) for n in range(100)]
+    memo = JSONEncoder(memoize=True, default=lambda point: [point.x])
+    assert memo.encode(data) == JSONEncoder().encode([[n] for n in range(100)])
+
+
+def test_memoize_detects_circular_reference():
+    data = {'a': [1]}
+    data['a'].append([data['a']])
+    with pytest.raises(ValueError, match='circular reference'):
+        JSONEncoder(memoize=True).encode(data)
+
+
+def test_memoize_shared_deep_subtree_needs_no_recursion():
+    shared = [0]
+    for _ in range(3000):
+        shared = [shared]
+    data = [shared, {'again': shared}, shared]
+    expected = JSONEncoder().encode(data)
+    memo = JSONEncoder(memoize=True)
+    assert ''.join(memo.iterencode(data)) == expected
+    assert memo.encode(data) == expected
+    assert b''.join(api.coalesce(memo.iterencode(data), 64)) == expected.encode()
+    assert b''.join(canonicalize_chunks(data, chunk_size=64)) == expected.encode()
+
+
+def test_memoize_unchecked_circular_reference_stops_at_depth_bound():
+    data = []
+    data.append(data)
+    memo = JSONEncoder(memoize=True, check_circular=False)
+    with pytest.raises(ValueError, match='maximum nesting depth'):
+        list(memo.iterencode([data, data]))
+
+
+def test_fragment_cache_serves_scalar_tuples_across_calls():
+    constants = (1, 1.0, True, None, 'x')
+    encoder = JSONEncoder(fragment_cache_size=4, collect_stats=True)
+    assert encoder.encode([constants, (1, (2,))]) == '[[1,1,true,null,"x"],[1,[2]]]'
+    assert encoder.stats['numbers'] == 1  # only the 1 in the tuple holding a tuple, all others come from the cache
+    data = {'c': (1, 1.0, True, None, 'x'), 'd': [(1, (2,))]}
+    assert encoder.encode(data) == '{"c":[1,1,true,null,"x"],"d":[[1,[2]]]}'
+    assert encoder.stats['numbers'] == 1
+    assert encoder.encode([(True,), (1,), (1.0,)]) == '[[true],[1],[1]]'
+
+
+STREAM_TEXTS = [
+    ' [1, 2.50, -0, -0.0, 1e21, 1E-7, 12345678901234567890, {"b": [true, false, null], "a": {}}, []] ',
+    '{"\\u20ac": 1, "\\ud83d\\ude00": "\\"x\\\\", "z": {"y": [{}], "x": "\\n"}, "z": 3}',
+    '"text"',
+    '-1.5e-3',
+]
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 1 << 16])
+@pytest.mark.parametrize('text', STREAM_TEXTS)
+def test_canonicalize_text_matches_canonicalize(text, chunk_size):
+    expected = canonicalize(json.loads(text))
+    assert b''.join(canonicalize_text(io.StringIO(text), chunk_size)) == expected
+    assert b''.join(canonicalize_text(io.BytesIO(text.encode()), chunk_size)) == expected
+
+
+def test_canonicalize_text_fixtures():
+    for path in pathlib.Path('test/fixtures/reference_upstream_input').glob('*.json'):
+        with open(path, 'r', encoding='utf-8') as source:
+            chunks = list(canonicalize_text(source, chunk_size=5))
+        assert b''.join(chunks) == canonicalize(json.loads(path.read_text(encoding='utf-8')))
+
+
+def test_canonicalize_text_streams_top_level_array():
+    records = [{'id': n, 'value': n / 7, 'nested': {'z': [n], 'a': None}} for n in range(1000)]
+    chunks = list(canonicalize_text(io.StringIO(json.dumps(records, indent=2)), chunk_size=1024))
+    assert len(chunks) > 1
+    assert b''.join(chunks) == canonicalize(records)
+
+
+def test_canonicalize_text_long_token_grows_window():
+    class Recording(io.StringIO):
+        def __init__(self, text):
+            super().__init__(text)
+            self.sizes = []
+
+        def read(self, size=-1):
+            self.sizes.append(size)
+            return super().read(size)
+
+    text = json.dumps(['x' * 100_000, 'é' * 10])
+    stream = Recording(text)
+    assert b''.join(canonicalize_text(stream, chunk_size=16)) == canonicalize(json.loads(text))
+    assert len(stream.sizes) < 32
+
+
+def test_canonicalize_text_unsorted_keeps_order():
+    text = '{"b": [1.0, {"d": 1, "c": 2}], "a": null}'
+    assert b''.join(canonicalize_text(io.StringIO(text), 3, sort_keys=False)) == serialize(json.loads(text))
+
+
+@pytest.mark.parametrize(
+    'text, message',
+    [
+        ('', 'expecting value at character offset 0'),
+        ('[1,]', 'expecting value at character offset 3'),
+        ('[1 2]', "expecting ',' or ']' at character offset 3"),
+        ('{"a" 1}', "expecting ':' delimiter at character offset 5"),
+        ('{"a": 1,}', 'expecting property name enclosed in double quotes at character offset 8'),
+        ('"abc', 'unterminated string at character offset 0'),
+        ('[NaN]', 'expecting value at character offset 1'),
+        ('[1] 2', 'extra data at character offset 4'),
+    ],
+)
+def test_canonicalize_text_invalid(text, message):
+    with pytest.raises(ValueError, match=message):
+        b''.join(canonicalize_text(io.StringIO(text), 2))
+
+
+class Level(enum.IntEnum):
+    LOW = 1
+
+
+BULK_ARRAYS = [
+    [n / 7 for n in range(-500, 500)] + [1e21, 1e-7, -0.0, 5e-324, 2.0**60],
+    list(range(-300, 300)) + [2**53, -(2**60)],
+    [f'ä"\n{n}' for n in range(100)],
+    [True, False, None] * 20,
+    [n / 2 for n in range(50)],
+    [Level.LOW] * 20 + [1, 2.5],
+    ['x', 1] * 20,
+]
+
+
+@pytest.mark.parametrize('indent', [None, 2])
+@pytest.mark.parametrize('seq', BULK_ARRAYS)
+def test_bulk_arrays_match_per_item_path(seq, indent):
+    data = {'seq': seq, 'tuple': tuple(seq), 'nested': [seq, [seq]]}
+    per_item = JSONEncoder(indent=indent, collect_stats=True)  # the instrumented engines keep the per item path
+    expected = per_item.encode(data)
+    encoder = JSONEncoder(indent=indent)
+    assert encoder.encode(data) == expected
+    assert encoder.encode_utf8(data) == expected.encode()
+    assert ''.join(encoder.iterencode(data)) == expected
+
+
+def test_bulk_arrays_stay_chunked():
+    seq = [n / 3 for n in range(20_000)]
+    chunks = list(CANONICAL_ENCODER.iterencode(seq))
+    assert len(chunks) > 1
+    assert ''.join(chunks) == canonicalize(seq, utf8=False)
+
+
+def test_bulk_arrays_reject_non_finite_numbers():
+    with pytest.raises(ValueError, match='invalid number'):
+        canonicalize([1.5] * 20 + [float('nan')])
+
+
+@pytest.mark.parametrize('typecode', ['b', 'H', 'i', 'q', 'Q', 'f', 'd'])
+def test_numeric_buffers_encode_as_arrays(typecode):
+    values = array.array(typecode, range(40) if typecode in 'bHiqQ' else [n / 7 for n in range(-20, 20)])
+    data = {'array': values, 'view': memoryview(values), 'short': values[:3], 'empty': values[:0]}
+    expected = {'array': values.tolist(), 'view': values.tolist(), 'short': values[:3].tolist(), 'empty': []}
+    for encoder in (CANONICAL_ENCODER, JSONEncoder(collect_stats=True), JSONEncoder(trusted=True, indent=1)):
+        assert encoder.encode(data) == encoder.encode(expected)
+        assert encoder.encode_utf8(data) == encoder.encode_utf8(expected)
+        assert ''.join(encoder.iterencode(data)) == encoder.encode(expected)
+
+
+def test_non_numeric_buffers_take_the_default_hook():
+    views = (memoryview(b'\x01\x00').cast('?'), memoryview(bytes(8)).cast('B', (2, 4)), memoryview(b'ab').cast('c'))
+    for value in views:
+        with pytest.raises(TypeError, match='is not JSON serializable'):
+            canonicalize(value)
+    assert JSONEncoder(default=memoryview.tolist).encode(memoryview(bytes(4)).cast('B', (2, 2))) == '[[0,0],[0,0]]'
+
+
+@pytest.mark.parametrize(
+    'data',
+    [
+        [{'id': n, 'v': n / 7, 'k': {'z': str(n), 'a': None}} for n in range(200)],
+        {f'key-{n * 7919 % 1000}': [n, 'ü'] for n in range(200)},
+        tuple(range(200)),
+    ],
+)
+def test_parallel_encoding_matches_sequential(data, monkeypatch):
+    monkeypatch.setattr(api, 'PARALLEL_MIN_ITEMS', 100)
+    assert canonicalize(data, jobs=2) == canonicalize(data)
+    assert serialize(data, utf8=False, jobs=2) == serialize(data, utf8=False)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+        assert api.encode_parallel(data, True, 3, executor) == canonicalize(data)
+
+
+def test_parallel_encoding_stays_sequential_below_threshold(monkeypatch):
+    def no_pool(*args, **kwargs):
+        raise AssertionError('process pool started')
+
+    monkeypatch.setattr(concurrent.futures, 'ProcessPoolExecutor', no_pool)
+    for data in (list(range(100)), {'b': 1, 'a': [2]}, 'text'):
+        assert canonicalize(data, jobs=4) == canonicalize(data)
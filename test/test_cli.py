@@ -1,8 +1,14 @@
 import _io  # type: ignore
+import hashlib
+import io
+import json
+import os
+
 import pytest
 
 import tallipoika.cli as cli
 from tallipoika import VERSION
+from tallipoika.api import canonicalize
 
 
 def test_parse_request_empty(capsys):
@@ -92,3 +98,287 @@ def test_app_version(capsys):
         out, err = capsys.readouterr()
         assert VERSION in out
         assert not err
+
+
+def test_app_lines_matches_canonicalize_per_record(tmp_path):
+    records = [{'b': 1.0, 'a': [1e21, 'ü']}, [56, {'d': True, '10': None}], 'text']
+    in_path = tmp_path / 'records.jsonl'
+    in_path.write_text('\n'.join(json.dumps(record, indent=1).replace('\n', '') for record in records) + '\n\n')
+    out_path = tmp_path / 'canonical.jsonl'
+    assert cli.app(['-s', '--lines', '-o', str(out_path), str(in_path)]) == 0
+    assert out_path.read_bytes() == b''.join(canonicalize(record) + b'\n' for record in records)
+
+
+def test_app_json_seq_to_stdout(capsys, tmp_path):
+    in_path = tmp_path / 'records.json-seq'
+    in_path.write_text('\x1e{"b": 2,\n "a": 1}\n\x1e[1.50]\n\x1e\n')
+    assert cli.app(['-s', '--json-seq', str(in_path)]) == 0
+    out, err = capsys.readouterr()
+    assert out == '\x1e{"a":1,"b":2}\n\x1e[1.5]\n'
+    assert not err
+
+
+def test_sequence_records_across_chunks():
+    source = io.StringIO('\x1e[1]\n\x1e{"a": "bcdefgh"}\n')
+    assert list(cli.sequence_records(source, chunk_size=3)) == ['', '[1]\n', '{"a": "bcdefgh"}\n']
+
+
+def test_app_lines_parallel_preserves_order(tmp_path):
+    records = [{'n': n, 'v': n / 7, 'k': {'z': str(n), 'a': None}} for n in range(50)]
+    in_path = tmp_path / 'records.jsonl'
+    in_path.write_text(''.join(json.dumps(record) + '\n' for record in records))
+    out_path = tmp_path / 'canonical.jsonl'
+    assert cli.app(['-s', '-l', '-j', '3', '--batch-size', '4', '-o', str(out_path), str(in_path)]) == 0
+    assert out_path.read_bytes() == b''.join(canonicalize(record) + b'\n' for record in records)
+
+
+def test_parse_request_jobs_requires_records(capsys):
+    with pytest.raises(SystemExit) as err:
+        cli.parse_request(['--jobs', '2'])
+    assert err.value.code == 2
+    out, err = capsys.readouterr()
+    assert 'parallel processing (--jobs) requires record streams (--lines or --json-seq)' in err
+    assert not out
+
+
+def test_app_chunked_document_output(tmp_path):
+    in_path = 'test/fixtures/reference_upstream_input/weird.json'
+    out_path = tmp_path / 'weird.json'
+    assert cli.app(['-s', '--chunk-size', '7', '-o', str(out_path), in_path]) == 0
+    with open(in_path, 'r', encoding='utf-8') as source:
+        assert out_path.read_bytes() == canonicalize(json.load(source))
+
+
+def test_app_stream_matches_loaded(tmp_path):
+    in_path = 'test/fixtures/reference_upstream_input/weird.json'
+    for flags in (['-s'], []):
+        loaded, streamed = tmp_path / 'loaded.json', tmp_path / 'streamed.json'
+        assert cli.app([*flags, '-o', str(loaded), in_path]) == 0
+        assert cli.app([*flags, '--stream', '--chunk-size', '7', '-o', str(streamed), in_path]) == 0
+        assert streamed.read_bytes() == loaded.read_bytes()
+
+
+def test_app_digest(capsys):
+    in_path = 'test/fixtures/reference_upstream_input/arrays.json'
+    assert cli.app(['-s', '--digest', in_path]) == 0
+    out, err = capsys.readouterr()
+    assert out == hashlib.sha256(b'[56,{"1":[],"10":null,"d":true}]').hexdigest() + '\n'
+    assert not err
+    assert cli.app(['-s', '-d', '--digest-algorithm', 'md5', in_path]) == 0
+    out, err = capsys.readouterr()
+    assert out == hashlib.md5(b'[56,{"1":[],"10":null,"d":true}]').hexdigest() + '\n'
+
+
+def test_parse_request_digest_unknown(capsys):
+    with pytest.raises(SystemExit) as err:
+        cli.parse_request(['--digest', '--digest-algorithm', 'shake_128'])
+    assert err.value.code == 2
+    out, err = capsys.readouterr()
+    assert 'requested digest algorithm (shake_128) is not available or has no fixed length' in err
+
+
+def test_app_check_canonical_source(capsys, tmp_path):
+    in_path = tmp_path / 'canonical.json'
+    in_path.write_bytes(b'[56,{"1":[],"10":null,"d":true}]')
+    assert cli.app(['-s', '--check', str(in_path)]) == 0
+    assert cli.app(['-s', '--check', '--chunk-size', '3', str(in_path)]) == 0
+    out, err = capsys.readouterr()
+    assert not out
+    assert not err
+
+
+@pytest.mark.parametrize(
+    'source, offset',
+    [
+        (b'[56,{"10":null,"1":[],"d":true}]', 7),
+        (b'[56, {"1":[],"10":null,"d":true}]', 4),
+        (b'[56,{"1":[],"10":null,"d":true}]\n', 32),
+    ],
+)
+def test_app_check_reports_first_difference(capsys, tmp_path, source, offset):
+    in_path = tmp_path / 'source.json'
+    in_path.write_bytes(source)
+    assert cli.app(['-s', '-c', '--chunk-size', '4', str(in_path)]) == 1
+    out, err = capsys.readouterr()
+    assert not out
+    assert err == f'{in_path}: source differs from its transform at byte offset {offset}\n'
+
+
+def test_app_check_always_canonical(capsys, tmp_path):
+    in_path = tmp_path / 'source.json'
+    in_path.write_bytes(b'{"b":1,"a":2}')
+    assert cli.app(['--check', str(in_path)]) == 1
+    assert cli.app(['--check', str(tmp_path)]) == 1
+    out, err = capsys.readouterr()
+    assert err == f'{in_path}: source differs from its transform at byte offset 2\n' * 2
+    in_path.write_bytes(b'{"a":2,"b":1}')
+    assert cli.app(['--check', str(in_path)]) == 0
+
+
+def test_app_check_invalid_source(capsys, tmp_path):
+    in_path = tmp_path / 'source.json'
+    in_path.write_bytes(b'[56,{"1":[],"10":null,"d":true')
+    assert cli.app(['-s', '--check', str(in_path)]) == 1
+    out, err = capsys.readouterr()
+    assert not out
+    assert err == f"{in_path}: expecting ',' or '}}' at character offset 30\n"
+
+
+def test_app_check_stops_reading_at_first_difference(monkeypatch, tmp_path):
+    in_path = tmp_path / 'records.json'
+    in_path.write_text('[{"b":1,"a":2}' + ',{"a":1}' * 100_000 + ']')
+    compared = []
+    first_difference = cli.first_difference
+
+    def counting(left, right):
+        compared.append(len(left))
+        return first_difference(left, right)
+
+    monkeypatch.setattr(cli, 'first_difference', counting)
+    assert cli.app(['-s', '--check', '--chunk-size', '64', str(in_path)]) == 1
+    assert len(compared) == 1
+    assert compared[0] < 2 * 64
+
+
+def test_app_check_lines(capsys, tmp_path):
+    in_path = tmp_path / 'records.jsonl'
+    in_path.write_text('{"a":1,"b":2}\n[1.5]\n')
+    assert cli.app(['-s', '--lines', '--check', str(in_path)]) == 0
+    in_path.write_text('{"a":1,"b":2}\n[1.50]\n')
+    assert cli.app(['-s', '--lines', '--check', '-j', '2', str(in_path)]) == 1
+    out, err = capsys.readouterr()
+    assert err.endswith('byte offset 18\n')
+
+
+def test_parse_request_check_conflicts(capsys, tmp_path):
+    in_path = tmp_path / 'source.json'
+    in_path.write_text('[]')
+    for argv in (['--check', '-d', str(in_path)], ['--check', '-o', 'out.json', str(in_path)], ['--check']):
+        with pytest.raises(SystemExit) as err:
+            cli.parse_request(argv)
+        assert err.value.code == 2
+        assert 'check mode (--check)' in capsys.readouterr().err
+
+
+def make_batch(folder):
+    (folder / 'sub').mkdir()
+    (folder / 'a.json').write_bytes(b'{"b":1,"a":[1.0,2]}')
+    (folder / 'sub' / 'b.json').write_bytes(b'{"a":1}')
+    (folder / 'sub' / 'notes.txt').write_text('no JSON')
+    return folder / 'a.json', folder / 'sub' / 'b.json'
+
+
+def test_app_in_place_folder(capsys, tmp_path):
+    changed, canonical = make_batch(tmp_path)
+    canonical.chmod(0o640)
+    assert cli.app(['-s', '--in-place', str(tmp_path)]) == 0
+    assert changed.read_bytes() == b'{"a":[1,2],"b":1}'
+    assert canonical.read_bytes() == b'{"a":1}'
+    assert canonical.stat().st_mode & 0o777 == 0o640
+    assert (tmp_path / 'sub' / 'notes.txt').read_text() == 'no JSON'
+    assert sorted(path.name for path in tmp_path.rglob('*')) == ['a.json', 'b.json', 'notes.txt', 'sub']
+    out, err = capsys.readouterr()
+    assert not out
+    assert not err
+
+
+def test_app_in_place_keeps_files_failing(capsys, tmp_path):
+    changed, _ = make_batch(tmp_path)
+    broken = tmp_path / 'sub' / 'broken.json'
+    broken.write_bytes(b'{"a":')
+    assert cli.app(['-s', '--in-place', '-j', '2', str(tmp_path / '**' / '*.json')]) == 1
+    assert changed.read_bytes() == b'{"a":[1,2],"b":1}'
+    assert broken.read_bytes() == b'{"a":'
+    out, err = capsys.readouterr()
+    assert err.startswith(f'{broken}: Expecting value')
+    assert len(err.splitlines()) == 1
+
+
+def test_app_check_folder(capsys, tmp_path):
+    changed, canonical = make_batch(tmp_path)
+    assert cli.app(['-s', '--check', str(tmp_path)]) == 1
+    assert changed.read_bytes() == b'{"b":1,"a":[1.0,2]}'
+    out, err = capsys.readouterr()
+    assert not out
+    assert err == f'{changed}: source differs from its transform at byte offset 2\n'
+    assert cli.app(['-s', '--check', str(tmp_path / 'sub' / '*.json')]) == 0
+
+
+def test_app_in_place_single_file_serialize(tmp_path):
+    in_path = tmp_path / 'source.json'
+    in_path.write_bytes(b'{"b": 1.0, "a": 2}')
+    assert cli.app(['--in-place', str(in_path)]) == 0
+    assert in_path.read_bytes() == b'{"b":1,"a":2}'
+
+
+def test_app_cache_skips_files_unchanged(monkeypatch, tmp_path):
+    changed, canonical = make_batch(tmp_path)
+    cache_path = tmp_path / 'cache.json'
+    assert cli.app(['-s', '--in-place', '--cache', '--cache-path', str(cache_path), str(tmp_path)]) == 0
+    entries = json.loads(cache_path.read_text())['canonical']
+    assert sorted(entries) == [str(changed.resolve()), str(canonical.resolve())]
+    assert entries[str(changed.resolve())][2] == hashlib.sha256(b'{"a":[1,2],"b":1}').hexdigest()
+
+    transformed = []
+    transform_file = cli.transform_file
+
+    def recording(serialize_only, in_place, known, path):
+        transformed.append((path.name, known))
+        return transform_file(serialize_only, in_place, known, path)
+
+    monkeypatch.setattr(cli, 'transform_file', recording)
+    assert cli.app(['-s', '--check', '--cache', '--cache-path', str(cache_path), str(tmp_path)]) == 0
+    assert not transformed
+    os.utime(canonical, ns=(0, 0))
+    assert cli.app(['-s', '--check', '--cache', '--cache-path', str(cache_path), str(tmp_path)]) == 0
+    assert transformed == [('b.json', entries[str(canonical.resolve())][2])]
+    canonical.write_bytes(b'{"a":2}')
+    assert cli.app(['-s', '--check', '--cache', '--cache-path', str(cache_path), str(tmp_path)]) == 0
+    changed.write_bytes(b'{"b":0,"a":0}')
+    assert cli.app(['-s', '--check', '--cache', '--cache-path', str(cache_path), str(tmp_path)]) == 1
+    assert str(changed.resolve()) not in json.loads(cache_path.read_text())['canonical']
+
+
+def test_app_cache_default_path_and_mode(monkeypatch, tmp_path):
+    make_batch(tmp_path)
+    monkeypatch.chdir(tmp_path)
+    umask = os.umask(0o027)
+    try:
+        assert cli.app(['--in-place', '--cache', '.']) == 0
+        assert cli.app(['--in-place', '--cache', '.']) == 0
+    finally:
+        os.umask(umask)
+    cache_path = tmp_path / cli.CACHE_NAME
+    assert cache_path.stat().st_mode & 0o777 == 0o640
+    assert cache_path.read_text().startswith('{\n "serialized": {')
+
+
+def test_app_in_place_reports_files_gone(capsys, tmp_path):
+    changed, canonical = make_batch(tmp_path)
+    options = cli.parse_request(['-s', '--in-place', str(tmp_path)])
+    canonical.unlink()
+    assert cli.process(options) == 1
+    assert changed.read_bytes() == b'{"a":[1,2],"b":1}'
+    out, err = capsys.readouterr()
+    assert err.startswith(f'{canonical}: [Errno 2]')
+
+
+def test_parse_request_batch_conflicts(capsys, tmp_path):
+    make_batch(tmp_path)
+    folder = str(tmp_path)
+    for argv, message in (
+        (['--in-place'], 'in place mode (--in-place) requires a source path'),
+        (['--in-place', '--check', folder], 'exclude each other'),
+        (['--in-place', '--lines', folder], 'conflict with --lines, --json-seq, and -o'),
+        (['--in-place', '-o', 'out.json', folder], 'conflict with --lines, --json-seq, and -o'),
+        (['--in-place', '-d', folder], 'cannot write a digest'),
+        (['--cache', str(tmp_path / 'a.json')], 'the cache (--cache) requires batch sources'),
+        ([str(tmp_path / '*.json')], 'is a glob and requires --in-place or --check'),
+        (['--check', str(tmp_path / '*.yaml')], 'matches no files'),
+        (['--check', str(tmp_path / 'sub' / 'sub')], 'does not exist'),
+        (['-j', '2', str(tmp_path / 'a.json')], 'or batch sources (directory, glob, or --in-place)'),
+    ):
+        with pytest.raises(SystemExit) as err:
+            cli.parse_request(argv)
+        assert err.value.code == 2
+        assert message in capsys.readouterr().err
@@ -0,0 +1,152 @@
+import copy
+import hashlib
+import random
+
+import pytest
+
+import tallipoika.document as document_module
+from tallipoika.api import canonicalize
+from tallipoika.document import CanonicalDocument, format_pointer, parse_pointer
+
+DATA = {
+    'name': 'ü',
+    'values': [1, 2.5, None, {'deep': [True, False]}],
+    'a/b': {'m~n': 1e21},
+    '€': [],
+    '10': {},
+}
+
+
+def test_pointer_round_trip():
+    assert parse_pointer('') == []
+    assert parse_pointer('/a~1b/m~0n/0') == ['a/b', 'm~n', '0']
+    assert format_pointer(['a/b', 'm~n', 0]) == '/a~1b/m~0n/0'
+    with pytest.raises(ValueError, match='does not start with'):
+        parse_pointer('a')
+
+
+def test_document_matches_canonicalize():
+    document = CanonicalDocument(DATA)
+    assert document.canonical() == canonicalize(DATA)
+    assert document.digest() == hashlib.sha256(canonicalize(DATA)).hexdigest()
+    assert document.fragment('/values/3') == canonicalize(DATA['values'][3])
+    assert document.get() == DATA
+
+
+def test_edits_match_canonicalize_of_edited_data():
+    document, data = CanonicalDocument(copy.deepcopy(DATA)), copy.deepcopy(DATA)
+    document.replace('/values/3/deep/1', 'x')
+    data['values'][3]['deep'][1] = 'x'
+    document.add('/values/-', {'b': 1, 'a': 2})
+    data['values'].append({'b': 1, 'a': 2})
+    document.add('/values/0', 0)
+    data['values'].insert(0, 0)
+    document.add('/a~1b/m~0n', [3])
+    data['a/b']['m~n'] = [3]
+    assert document.remove('/name') == 'ü'
+    del data['name']
+    document.add('/a~1b/z', 'new')
+    data['a/b']['z'] = 'new'
+    assert document.canonical() == canonicalize(data)
+    assert document.get() == data
+    assert document.digest() == hashlib.sha256(canonicalize(data)).hexdigest()
+
+
+def test_apply_patch():
+    document = CanonicalDocument(copy.deepcopy(DATA))
+    document.apply_patch(
+        [
+            {'op': 'test', 'path': '/values/1', 'value': 2.5},
+            {'op': 'move', 'from': '/values/3', 'path': '/moved'},
+            {'op': 'copy', 'from': '/moved', 'path': '/copied'},
+            {'op': 'replace', 'path': '/copied/deep', 'value': 'changed'},
+            {'op': 'remove', 'path': '/10'},
+        ]
+    )
+    expected = copy.deepcopy(DATA)
+    expected['moved'] = expected['values'].pop(3)
+    expected['copied'] = {'deep': 'changed'}
+    del expected['10']
+    assert document.canonical() == canonicalize(expected)
+
+
+def test_failing_patch_is_rolled_back():
+    document = CanonicalDocument(copy.deepcopy(DATA))
+    before = document.canonical()
+    with pytest.raises(ValueError, match='test of'):
+        document.apply_patch(
+            [
+                {'op': 'add', 'path': '/values/0', 'value': 'first'},
+                {'op': 'remove', 'path': '/€'},
+                {'op': 'replace', 'path': '', 'value': []},
+                {'op': 'test', 'path': '', 'value': {}},
+            ]
+        )
+    assert document.canonical() == before
+    assert document.get() == DATA
+
+
+@pytest.mark.parametrize(
+    'pointer, message',
+    (
+        ('/missing/x', 'not found'),
+        ('/values/9', 'out of range'),
+        ('/values/01', 'invalid array index'),
+        ('/name/x', 'scalar'),
+    ),
+)
+def test_invalid_paths(pointer, message):
+    document = CanonicalDocument(DATA)
+    with pytest.raises(ValueError, match=message):
+        document.replace(pointer, 1)
+
+
+def test_wide_container_edits_match_canonicalize(monkeypatch):
+    monkeypatch.setattr(document_module, 'SLICE_SIZE', 4)
+    data = {'items': list(range(50)), 'members': {f'k{n}': n for n in range(50)}}
+    document, rng = CanonicalDocument(copy.deepcopy(data)), random.Random(42)
+    for step in range(300):
+        items, members = data['items'], data['members']
+        choice = rng.randrange(6)
+        if choice == 0:
+            index = rng.randrange(len(items) + 1)
+            document.add(f'/items/{index}', step)
+            items.insert(index, step)
+        elif choice == 1 and items:
+            index = rng.randrange(len(items))
+            assert document.remove(f'/items/{index}') == items.pop(index)
+        elif choice == 2 and items:
+            index = rng.randrange(len(items))
+            document.replace(f'/items/{index}', [step])
+            items[index] = [step]
+        elif choice == 3:
+            name = f'k{rng.randrange(80)}'
+            document.add(f'/members/{name}', step)
+            members[name] = step
+        elif choice == 4 and members:
+            name = rng.choice(sorted(members))
+            assert document.remove(f'/members/{name}') == members.pop(name)
+        if step % 7 == 0:
+            assert document.canonical() == canonicalize(data)
+    assert document.canonical() == canonicalize(data)
+    assert document.get() == data
+
+
+@pytest.mark.parametrize('width', (1_000, 100_000))
+def test_edit_cost_does_not_scale_with_sibling_count(monkeypatch, width):
+    joined = []
+    join_slice = document_module._join_slice
+
+    def counting_join_slice(node, members):
+        joined.append(len(members))
+        return join_slice(node, members)
+
+    document = CanonicalDocument({'rows': [{'id': n, 'tags': ['a']} for n in range(width)]})
+    document.canonical()
+    monkeypatch.setattr(document_module, '_join_slice', counting_join_slice)
+    document.replace(f'/rows/{width // 2}/tags/0', 'b')
+    document.add('/rows/7/extra', True)
+    document.canonical()
+    # Only the changed slices on the paths are re-joined (the leaf arrays, objects, rows slices, and the root)
+    assert sum(joined) <= 2 * (1 + 3 + document_module.SLICE_SIZE + 1)
+    assert document.fragment(f'/rows/{width // 2}') == canonicalize({'id': width // 2, 'tags': ['b']})
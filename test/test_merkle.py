@@ -0,0 +1,56 @@
+import copy
+
+import pytest
+
+from tallipoika.api import canonical_digest
+from tallipoika.merkle import diff, digest_tree, verify
+
+DATA = {
+    'name': 'ü',
+    'values': [1, 2.5, None, {'deep': [True, False]}],
+    'a/b': {'m~n': 1e21},
+    '10': (),
+}
+
+
+def test_digests_match_canonical_digest_per_subtree():
+    tree = digest_tree(DATA)
+    assert tree.hexdigest() == canonical_digest(DATA)
+    assert tree.find('/values/3/deep').hexdigest() == canonical_digest([True, False])
+    assert tree.find('/a~1b/m~0n').hexdigest() == canonical_digest(1e21)
+    assert digest_tree(DATA, algorithm='sha512').hexdigest() == canonical_digest(DATA, algorithm='sha512')
+    with pytest.raises(ValueError, match='no tree at'):
+        tree.find('/values/4')
+
+
+def test_diff_descends_into_differing_digests_only():
+    changed = copy.deepcopy(DATA)
+    changed['values'][3]['deep'][1] = 0
+    changed['values'].append('extra')
+    changed['new'] = 1
+    del changed['name']
+    changed['a/b'] = ['type', 'changed']
+    left, right = digest_tree(DATA), digest_tree(changed)
+    assert diff(left, left) == []
+    assert diff(left, right) == ['/a~1b', '/name', '/new', '/values/3/deep/1', '/values/4']
+
+
+def test_diff_reports_members_in_canonical_order():
+    left = {'\ufb01': 1, '\U0001f600': 1, 'a': 1}
+    right = {'\ufb01': 2, '\U0001f600': 2, 'a': 2}
+    assert diff(digest_tree(left), digest_tree(right)) == ['/a', '/\U0001f600', '/\ufb01']
+
+
+def test_verify_subtree():
+    tree = digest_tree(DATA)
+    assert verify(tree, '/values/3', {'deep': [True, False]})
+    assert not verify(tree, '/values/3', {'deep': [True]})
+
+
+def test_deep_documents_need_no_recursion():
+    data = [0]
+    for level in range(5000):
+        data = [data, {'level': level}]
+    tree = digest_tree(data)
+    assert tree.hexdigest() == canonical_digest(data)
+    assert diff(tree, digest_tree([data[0], {'level': 'changed'}])) == ['/1/level']
@@ -2,6 +2,8 @@ import binascii
 import pathlib
 import struct
 
+import pytest
+
 import tallipoika.py2es6 as py2es6
 
 COMMA = ','
@@ -46,3 +48,44 @@ def test_reference():
                 if i <= 0 or i >= len(line) - 1:
                     raise ValueError(f'bad line ({line}) at {count}')
                 assert verify(line[:i], line[i + 1 : len(line) - 1]) is None
+
+
+def test_integer_fast_path():
+    assert py2es6.serialize(0) == '0'
+    assert py2es6.serialize(-256) == '-256'
+    assert py2es6.serialize(1023) == '1023'
+    assert py2es6.serialize(True) == '1'
+    assert py2es6.serialize(2**53 - 1) == '9007199254740991'
+    assert py2es6.serialize(2**53 + 1) == '9007199254740992'
+    assert py2es6.serialize(10**21) == '1e+21'
+
+
+def test_float_cache():
+    assert py2es6.float_cache_info() is None
+    py2es6.set_float_cache(16)
+    try:
+        assert py2es6.serialize_many([0.5, 1e-7, 0.5, -0.0, 3]) == ['0.5', '1e-7', '0.5', '0', '3']
+        info = py2es6.float_cache_info()
+        assert info.hits == 1
+        assert info.misses == 2
+    finally:
+        py2es6.set_float_cache(0)
+    assert py2es6.float_cache_info() is None
+
+
+def test_join_floats_matches_serialize():
+    floats = [1e21, 1e-7, 5e-324, -0.0, 0.0, 1.0, -10.0, 123456789012345680000.0, 1e16, 2.0**53, 0.1, -5e-7, 1e300]
+    floats += [struct.unpack('>d', (n * 0x9E3779B97F4A7C15 % 2**63).to_bytes(8, 'big'))[0] for n in range(1000)]
+    assert py2es6.join_floats(floats) == COMMA.join(map(py2es6.serialize, floats))
+    assert py2es6.join_floats(floats, ', ') == ', '.join(map(py2es6.serialize, floats))
+    assert py2es6.join_floats([-0.0]) == '0'
+    for non_finite in (float('nan'), float('-inf')):
+        with pytest.raises(ValueError, match='invalid number'):
+            py2es6.join_floats([1.0, non_finite])
+
+
+def test_join_ints_matches_serialize():
+    ints = [0, 1, -1, 2**53 - 1, -(2**53 - 1), 255, -256, 1024]
+    assert py2es6.join_ints(ints) == COMMA.join(map(py2es6.serialize, ints))
+    ints.append(2**60)
+    assert py2es6.join_ints(ints, ' ') == ' '.join(map(py2es6.serialize, ints))